@@ -0,0 +1,183 @@
+import base64
+import json
+import mimetypes
+
+from django.db import transaction
+from django.db.models import Prefetch
+
+from api.serializers import RecipeWriteSerializer
+from recipes.cache import (
+    invalidate_authors_feed,
+    invalidate_recipe_ingredients,
+    invalidate_recipes,
+)
+from recipes.counters import change_counter
+from recipes.images import schedule_thumbnails
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from recipes.search import schedule_search_update
+from recipes.utils import batches
+from users.models import User
+
+IMPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 500
+
+
+def read_ndjson(lines):
+    """
+    Разбирает строки NDJSON, пропуская пустые, с номером строки.
+    Вместо записи из некорректной строки возвращается JSONDecodeError.
+    """
+
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as error:
+            yield number, error
+
+
+def to_pk(value):
+    if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+        return int(value)
+    return None
+
+
+def load_known_objects(records):
+    """
+    Загружает ингредиенты и теги всех рецептов пачки двумя запросами,
+    чтобы сериализаторы не обращались к базе для каждого рецепта.
+    """
+
+    ingredient_ids, tag_ids = set(), set()
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        ingredients = record.get('ingredients')
+        if isinstance(ingredients, list):
+            ingredient_ids.update(to_pk(item.get('id')) for item in ingredients
+                                  if isinstance(item, dict))
+        tags = record.get('tags')
+        if isinstance(tags, list):
+            tag_ids.update(to_pk(tag) for tag in tags)
+    ingredient_ids.discard(None)
+    tag_ids.discard(None)
+    return {
+        Ingredient: Ingredient.objects.in_bulk(ingredient_ids),
+        Tag: Tag.objects.in_bulk(tag_ids),
+    }
+
+
+@transaction.atomic
+def save_recipes(recipes_data, author):
+    """Сохраняет пачку проверенных рецептов через bulk_create."""
+
+    recipes = Recipe.objects.bulk_create(
+        Recipe(author=author,
+               **{field: value for field, value in recipe_data.items()
+                  if field not in ('ingredients', 'tags')})
+        for recipe_data in recipes_data
+    )
+    IngredientInRecipe.objects.bulk_create(
+        IngredientInRecipe(recipe=recipe,
+                           ingredient=ingredient_data['id'],
+                           amount=ingredient_data['amount'])
+        for recipe, recipe_data in zip(recipes, recipes_data)
+        for ingredient_data in recipe_data['ingredients']
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe=recipe, tag=tag)
+        for recipe, recipe_data in zip(recipes, recipes_data)
+        for tag in set(recipe_data['tags'])
+    )
+    change_counter(User.objects.filter(pk=author.pk),
+                   'recipes_count', len(recipes))
+    pks = [recipe.pk for recipe in recipes]
+
+    def process_images():
+        for pk in pks:
+            schedule_thumbnails(pk)
+
+    invalidate_recipes(*pks)
+    invalidate_authors_feed(author.pk)
+    invalidate_recipe_ingredients()
+    schedule_search_update(*pks)
+    transaction.on_commit(process_images)
+    return recipes
+
+
+def import_recipes(lines, author, batch_size=IMPORT_BATCH_SIZE, request=None):
+    """
+    Импортирует рецепты из строк NDJSON пачками. Некорректные записи
+    пропускаются и возвращаются в списке ошибок с номерами строк.
+    """
+
+    created, errors = 0, []
+    for batch in batches(read_ndjson(lines), batch_size):
+        context = {
+            'request': request,
+            'known_objects': load_known_objects(
+                record for _, record in batch
+            ),
+        }
+        recipes_data = []
+        for number, record in batch:
+            if isinstance(record, json.JSONDecodeError):
+                errors.append({'line': number,
+                               'errors': f'Некорректный JSON: {record}'})
+                continue
+            if not isinstance(record, dict):
+                errors.append({'line': number,
+                               'errors': 'Ожидается JSON-объект рецепта'})
+                continue
+            serializer = RecipeWriteSerializer(data=record, context=context)
+            if serializer.is_valid():
+                recipes_data.append(serializer.validated_data)
+            else:
+                errors.append({'line': number, 'errors': serializer.errors})
+        if recipes_data:
+            created += len(save_recipes(recipes_data, author))
+    return created, errors
+
+
+def image_to_data_url(image):
+    content_type = mimetypes.guess_type(image.name)[0] or 'image/jpeg'
+    with image.open('rb') as image_file:
+        encoded = base64.b64encode(image_file.read()).decode()
+    return f'data:{content_type};base64,{encoded}'
+
+
+def export_recipes(queryset, include_images=False):
+    """
+    Отдает рецепты построчно в NDJSON. Формат совместим с импортом,
+    если картинки включены в виде data URL.
+    """
+
+    queryset = queryset.prefetch_related(
+        'tags',
+        Prefetch(
+            'ingredientinrecipe_set',
+            queryset=IngredientInRecipe.objects.select_related('ingredient')
+        )
+    )
+    for recipe in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        record = {
+            'id': recipe.id,
+            'author': recipe.author_id,
+            'pub_date': recipe.pub_date.isoformat(),
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'tags': [tag.id for tag in recipe.tags.all()],
+            'ingredients': [
+                {'id': item.ingredient_id,
+                 'name': item.ingredient.name,
+                 'measurement_unit': item.ingredient.measurement_unit,
+                 'amount': item.amount}
+                for item in recipe.ingredientinrecipe_set.all()
+            ],
+            'image': (image_to_data_url(recipe.image) if include_images
+                      else recipe.image.url),
+        }
+        yield json.dumps(record, ensure_ascii=False) + '\n'
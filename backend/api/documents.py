@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from api.relations import get_user_relations
+from recipes.cache import get_catalog_version, get_recipes_versions
+from recipes.models import IngredientInRecipe, Recipe
+
+RECIPE_DOCUMENT_KEY = 'recipes:{}:document:{}:{}'
+RECIPE_PAGE_FIELDS = ('id', 'pub_date', 'popularity')
+"""Поля рецептов страницы: id документа и поля сортировки для курсора."""
+
+
+def build_documents(pks, serializer_class, context):
+    """
+    Собирает документы рецептов сериализатором за четыре запроса.
+    Флаги пользователя заполняются значениями по умолчанию и
+    подменяются при выдаче.
+    """
+
+    recipes = list(
+        Recipe.objects.filter(pk__in=pks).defer(
+            'search_vector'
+        ).prefetch_related(
+            'tags',
+            'author',
+            Prefetch(
+                'ingredientinrecipe_set',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+    )
+    for recipe in recipes:
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe.author.is_subscribed = False
+    return {
+        document['id']: document
+        for document in serializer_class(recipes, many=True,
+                                         context=context).data
+    }
+
+
+def get_documents(pks, serializer_class, context):
+    """
+    Возвращает документы рецептов в порядке pks. Документы лежат в кеше
+    под ключом с версией рецепта и каталога, поэтому изменение рецепта,
+    его состава, тегов, автора или справочников дает новый ключ.
+    Недостающие документы собираются одной пачкой.
+    """
+
+    catalog_version = get_catalog_version()
+    keys = {
+        pk: RECIPE_DOCUMENT_KEY.format(pk, version, catalog_version)
+        for pk, version in zip(pks, get_recipes_versions(pks))
+    }
+    cached = cache.get_many(keys.values())
+    documents = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in pks if pk not in documents]
+    if missing:
+        built = build_documents(missing, serializer_class, context)
+        cache.set_many({keys[pk]: document
+                        for pk, document in built.items()},
+                       settings.RECIPE_DOCUMENT_CACHE_TIMEOUT)
+        documents.update(built)
+    return [documents[pk] for pk in pks if pk in documents]
+
+
+def overlay_user_flags(documents, request):
+    """
+    Проставляет в документы флаги текущего пользователя по множествам
+    его связей без запросов на каждую страницу.
+    """
+
+    if not request.user.is_authenticated:
+        for document in documents:
+            document['is_favorited'] = False
+            document['is_in_shopping_cart'] = False
+            document['author']['is_subscribed'] = None
+        return documents
+
+    relations = get_user_relations(request)
+    for document in documents:
+        document['is_favorited'] = relations.is_favorited(document['id'])
+        document['is_in_shopping_cart'] = relations.is_in_shopping_cart(
+            document['id']
+        )
+        document['author']['is_subscribed'] = relations.is_subscribed(
+            document['author']['id']
+        )
+    return documents
+
+
+def represent_recipes(recipes, serializer_class, context):
+    """Документы рецептов с флагами пользователя из запроса."""
+
+    documents = get_documents([recipe.pk for recipe in recipes],
+                              serializer_class, context)
+    return overlay_user_flags(documents, context['request'])
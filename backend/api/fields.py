@@ -0,0 +1,60 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField
+
+
+def resolve_pks(queryset, values, error_message, known=None):
+    """
+    Загружает объекты по списку первичных ключей одним запросом
+    in_bulk и сообщает обо всех отсутствующих ключах в одной ошибке.
+    Объекты из known, загруженные заранее, повторно не запрашиваются.
+    """
+
+    pk_field = queryset.model._meta.pk
+    if any(value is None or isinstance(value, bool) for value in values):
+        raise serializers.ValidationError('Некорректный тип ключа')
+    try:
+        pks = [pk_field.to_python(value) for value in values]
+    except (DjangoValidationError, TypeError, ValueError):
+        raise serializers.ValidationError('Некорректный тип ключа')
+    known = known or {}
+    objects = {pk: known[pk] for pk in pks if pk in known}
+    unknown = set(pks) - objects.keys()
+    if unknown:
+        objects.update(queryset.in_bulk(unknown))
+    missing = sorted(set(pks) - objects.keys(), key=str)
+    if missing:
+        raise serializers.ValidationError(
+            error_message.format(', '.join(map(str, missing)))
+        )
+    return [objects[pk] for pk in pks]
+
+
+class BulkManyRelatedField(ManyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        queryset = self.child_relation.get_queryset()
+        return resolve_pks(
+            queryset,
+            data,
+            'Объекты не найдены: {}',
+            self.context.get('known_objects', {}).get(queryset.model)
+        )
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField, который при many=True проверяет
+    все ключи одним запросом вместо запроса на каждый ключ.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
@@ -1,11 +1,74 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 
-from recipes.models import Ingredient
+from recipes.models import Recipe
+from recipes.search import search_recipes
 
+RECIPE_ORDERINGS = {
+    'new': ('-pub_date', '-id'),
+    'popular': ('-popularity', '-id'),
+}
+SEARCH_ORDERING = ('-rank', *RECIPE_ORDERINGS['new'])
 
-class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(lookup_expr='istartswith')
+
+class RecipeFilter(filters.FilterSet):
+    """
+    Фильтры рецептов через подзапросы EXISTS, чтобы не размножать
+    строки рецептов соединениями и не вызывать distinct().
+    """
+
+    tags = filters.CharFilter(method='filter_tags')
+    author = filters.NumberFilter(field_name='author')
+    is_favorited = filters.NumberFilter(method='filter_is_favorited')
+    is_in_shopping_cart = filters.NumberFilter(
+        method='filter_is_in_shopping_cart'
+    )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=[(ordering, ordering) for ordering in RECIPE_ORDERINGS],
+        method='filter_ordering'
+    )
 
     class Meta:
-        model = Ingredient
-        fields = ('name', )
+        model = Recipe
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering')
+
+    def filter_tags(self, queryset, name, value):
+        tags = self.request.query_params.getlist(name)
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe=OuterRef('pk'), tag__slug__in=tags
+                )
+            )
+        )
+
+    def filter_user_relation(self, queryset, relation, value):
+        if value != 1:
+            return queryset
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(
+            Exists(
+                relation.through.objects.filter(
+                    recipe=OuterRef('pk'), user=user
+                )
+            )
+        )
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_relation(queryset, Recipe.favorite, value)
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_user_relation(queryset, Recipe.shoppingcart, value)
+
+    def filter_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return search_recipes(queryset, value).order_by(*SEARCH_ORDERING)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
@@ -0,0 +1,183 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.profiling import percentile
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+
+def scenarios():
+    """Сценарии замеров: имя -> адрес запроса."""
+
+    recipe = Recipe.objects.order_by('-favorites_count', '-id').first()
+    if recipe is None:
+        raise CommandError('Нет рецептов, сначала выполните generate_data')
+    author = User.objects.order_by('-recipes_count', '-id').first()
+    tags = '&'.join(f'tags={slug}' for slug in
+                    Tag.objects.values_list('slug', flat=True)[:2])
+    ingredient = Ingredient.objects.order_by('id').first()
+    prefix = ingredient.name[:3] if ingredient else 'а'
+    word = recipe.name.split()[0].strip(':')
+    return {
+        'recipes_list': '/api/recipes/?limit=10',
+        'recipes_list_tags': f'/api/recipes/?limit=10&{tags}',
+        'recipes_list_author': f'/api/recipes/?limit=10&author={author.pk}',
+        'recipes_list_favorited': '/api/recipes/?limit=10&is_favorited=1',
+        'recipes_list_popular': '/api/recipes/?limit=10&ordering=popular',
+        'recipes_search': f'/api/recipes/?limit=10&search={word}',
+        'recipe_detail': f'/api/recipes/{recipe.pk}/',
+        'subscriptions': '/api/users/subscriptions/?limit=10'
+                         '&recipes_limit=3',
+        'shopping_cart': '/api/recipes/download_shopping_cart/',
+        'ingredients_search': f'/api/ingredients/?name={prefix}',
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'), cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Замеряет основные запросы API внутри процесса: перцентили '
+            'времени ответа, число запросов к базе и выделение памяти. '
+            'Результат можно сохранить в JSON и сравнить с прошлым')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--user', type=int,
+                            help='id пользователя, от имени которого идут '
+                                 'запросы. По умолчанию - самый активный')
+        parser.add_argument('--scenario', action='append',
+                            help='Выполнить только указанные сценарии')
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кеш перед каждым запросом')
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+        parser.add_argument('--compare',
+                            help='JSON прошлого запуска для сравнения')
+
+    def get_user(self, pk):
+        if pk is not None:
+            user = User.objects.filter(pk=pk).first()
+        else:
+            user = User.objects.annotate(
+                follows=Count('follower', distinct=True),
+                carts=Count('shoppingcart', distinct=True),
+            ).order_by('-follows', '-carts', 'id').first()
+        if user is None:
+            raise CommandError('Нет пользователя для запросов')
+        return user
+
+    def request(self, client, url, cold):
+        if cold:
+            cache.clear()
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(f'{url}: {response.status_code}')
+        return response
+
+    def measure(self, client, url, options):
+        for _ in range(options['warmup']):
+            self.request(client, url, options['cold'])
+
+        timings, queries = [], []
+        for _ in range(options['repeat']):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                self.request(client, url, options['cold'])
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(context.captured_queries))
+
+        tracemalloc.start()
+        self.request(client, url, options['cold'])
+        allocated, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'url': url,
+            'p50': round(percentile(timings, 50), 2),
+            'p90': round(percentile(timings, 90), 2),
+            'p99': round(percentile(timings, 99), 2),
+            'mean': round(statistics.mean(timings), 2),
+            'queries': max(queries),
+            'allocated_kb': round(allocated / 1024, 1),
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+    def write_result(self, name, result, baseline):
+        line = (f'{name:<24} p50 {result["p50"]:8.2f} мс  '
+                f'p90 {result["p90"]:8.2f} мс  '
+                f'p99 {result["p99"]:8.2f} мс  '
+                f'запросов {result["queries"]:3}  '
+                f'пик {result["peak_kb"]:9.1f} КБ')
+        previous = baseline.get(name)
+        if previous:
+            change = (result['p50'] / previous['p50'] - 1) * 100
+            line += (f'  p50 {change:+6.1f}%  запросов '
+                     f'{result["queries"] - previous["queries"]:+d}')
+        self.stdout.write(line)
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть больше нуля')
+        user = self.get_user(options['user'])
+        urls = scenarios()
+        names = options['scenario'] or list(urls)
+        unknown = set(names) - set(urls)
+        if unknown:
+            raise CommandError('Неизвестные сценарии: '
+                               + ', '.join(sorted(unknown)))
+        baseline = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)['scenarios']
+
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+        results = {}
+        for name in names:
+            results[name] = self.measure(client, urls[name], options)
+            self.write_result(name, results[name], baseline)
+
+        if options['output']:
+            report = {
+                'meta': {
+                    'commit': git_commit(),
+                    'created': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'database': connection.vendor,
+                    'user': user.pk,
+                    'recipes': Recipe.objects.count(),
+                    'users': User.objects.count(),
+                    'repeat': options['repeat'],
+                    'cold': options['cold'],
+                },
+                'scenarios': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(
+                self.style.SUCCESS(f'Результат записан в {options["output"]}')
+            )
@@ -0,0 +1,59 @@
+import base64
+import io
+import os
+import tracemalloc
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from PIL import Image
+from rest_framework import serializers
+
+from api.serializers import Base64ImageField
+
+
+class LegacyBase64ImageField(serializers.ImageField):
+    """Прежняя реализация: split всей строки и декодирование целиком."""
+
+    def to_internal_value(self, data):
+        format, imgstr = data.split(';base64,')
+        ext = format.split('/')[-1]
+        data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+        return super().to_internal_value(data)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пиковое потребление памяти при разборе картинки '
+            'в base64 прежним и потоковым способом')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--side', type=int, default=1500,
+                            help='Сторона случайной PNG-картинки в пикселях')
+
+    def measure(self, field, data):
+        tracemalloc.start()
+        image = field.to_internal_value(data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        image.close()
+        return peak
+
+    def handle(self, *args, **options):
+        side = options['side']
+        buffer = io.BytesIO()
+        Image.frombytes(
+            'RGB', (side, side), os.urandom(side * side * 3)
+        ).save(buffer, 'PNG')
+        data = ('data:image/png;base64,'
+                + base64.b64encode(buffer.getvalue()).decode())
+        self.stdout.write(f'Картинка: {len(buffer.getvalue())} байт, '
+                          f'строка base64: {len(data)} байт')
+
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=len(data),
+                               RECIPE_IMAGE_MAX_DIMENSION=side):
+            for label, field in (('прежний', LegacyBase64ImageField()),
+                                 ('потоковый', Base64ImageField())):
+                peak = self.measure(field, data)
+                self.stdout.write(
+                    f'{label:>10}: пик {peak / 1024 ** 2:8.2f} МБ'
+                )
@@ -0,0 +1,70 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIClient
+
+from users.models import User
+
+RECIPES_URL = '/api/recipes/'
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время ответа первой и глубокой страницы рецептов '
+            'при разбивке по номеру страницы и по курсору')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=1000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def measure(self, client, url, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: {response.status_code}')
+        return statistics.median(timings)
+
+    def cursor_url(self, client, page, limit):
+        """Проходит по ссылкам next до нужной страницы."""
+
+        url = f'{RECIPES_URL}?pagination=cursor&limit={limit}'
+        for reached in range(1, page):
+            next_url = client.get(url).data['next']
+            if next_url is None:
+                return url, reached
+            url = next_url
+        return url, page
+
+    def handle(self, *args, **options):
+        page, limit, repeat = (options['page'],
+                               options['limit'],
+                               options['repeat'])
+        user = User.objects.first()
+        if user is None:
+            raise CommandError('Нет пользователей для запросов')
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+
+        last_page = max(
+            (client.get(f'{RECIPES_URL}?limit={limit}').data['count']
+             + limit - 1) // limit,
+            1
+        )
+        page = min(page, last_page)
+        cursor_url, cursor_page = self.cursor_url(client, page, limit)
+
+        results = (
+            ('page', 1, f'{RECIPES_URL}?page=1&limit={limit}'),
+            ('page', page, f'{RECIPES_URL}?page={page}&limit={limit}'),
+            ('cursor', 1, f'{RECIPES_URL}?pagination=cursor&limit={limit}'),
+            ('cursor', cursor_page, cursor_url),
+        )
+        for mode, number, url in results:
+            self.stdout.write(
+                f'{mode:>6} страница {number:>6}: '
+                f'{self.measure(client, url, repeat):8.2f} мс'
+            )
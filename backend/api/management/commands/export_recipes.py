@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.bulk import export_recipes
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты в формате NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', help='По умолчанию stdout')
+        parser.add_argument(
+            '--with-images',
+            action='store_true',
+            help='Включить картинки как data URL для повторного импорта'
+        )
+
+    def handle(self, *args, **options):
+        lines = export_recipes(Recipe.objects.all(),
+                               include_images=options['with_images'])
+        if options['file'] is None:
+            sys.stdout.writelines(lines)
+            return
+        with open(options['file'], 'w', encoding='utf-8') as data_file:
+            data_file.writelines(lines)
@@ -0,0 +1,45 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk import IMPORT_BATCH_SIZE, import_recipes
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Импортирует рецепты из файла NDJSON пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--author',
+                            required=True,
+                            help='Email автора импортируемых рецептов')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(email=options['author'])
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {options["author"]} не найден')
+
+        start = time.perf_counter()
+        with open(options['file'], 'r', encoding='utf-8') as data_file:
+            created, errors = import_recipes(data_file,
+                                             author=author,
+                                             batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        for error in errors:
+            self.stderr.write(
+                f'Строка {error["line"]}: '
+                + json.dumps(error['errors'], ensure_ascii=False)
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Импортировано рецептов: {created}, ошибок: {len(errors)}, '
+                f'{created / elapsed if elapsed else created:.0f} рецептов/с'
+            )
+        )
@@ -0,0 +1,125 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from recipes.cache import (
+    get_catalog_version,
+    get_recipes_version,
+    incr_counter,
+)
+
+RESPONSE_CACHE_HITS_KEY = 'recipes:response:hits'
+RESPONSE_CACHE_MISSES_KEY = 'recipes:response:misses'
+
+
+class CatalogCacheMixin:
+    """
+    Отдает список справочника готовыми байтами JSON из кеша
+    с ETag по версии каталога и поддержкой условных запросов.
+    """
+
+    catalog_name = None
+
+    def get_catalog_data(self):
+        raise NotImplementedError
+
+    def get_catalog_key(self):
+        query = self.request.query_params.urlencode()
+        return hashlib.md5(query.encode()).hexdigest()
+
+    def list(self, request, *args, **kwargs):
+        etag = '"{}-{}-{}"'.format(self.catalog_name,
+                                   get_catalog_version(),
+                                   self.get_catalog_key())
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            cache_key = f'catalog:{etag}'
+            content = cache.get(cache_key)
+            if content is None:
+                content = JSONRenderer().render(self.get_catalog_data())
+                cache.set(cache_key, content)
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response,
+                            public=True,
+                            max_age=settings.CATALOG_CACHE_MAX_AGE)
+        return response
+
+
+class AnonymousCacheMixin:
+    """
+    Кеширует данные ответов list и retrieve для анонимных
+    пользователей с ключом по нормализованным параметрам запроса
+    и версиям рецептов и каталога.
+    """
+
+    def get_response_cache_key(self):
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        pk = int(lookup) if lookup is not None else None
+        params = sorted(
+            (key, sorted(values))
+            for key, values in self.request.query_params.lists()
+        )
+        digest = hashlib.md5(
+            repr((self.request.get_host(), params)).encode()
+        ).hexdigest()
+        return 'recipes:response:{}:{}:{}:{}:{}'.format(
+            self.action,
+            pk,
+            get_recipes_version(pk),
+            get_catalog_version(),
+            digest
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        try:
+            cache_key = self.get_response_cache_key()
+        except ValueError:
+            return handler(request, *args, **kwargs)
+
+        data = cache.get(cache_key)
+        if data is not None:
+            incr_counter(RESPONSE_CACHE_HITS_KEY)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        incr_counter(RESPONSE_CACHE_MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(cache_key, response.data,
+                      settings.RECIPES_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve,
+                                    request, *args, **kwargs)
+
+
+def get_response_cache_stats():
+    """Попадания и промахи кеша ответов для анонимов по всем процессам."""
+
+    stats = cache.get_many((RESPONSE_CACHE_HITS_KEY,
+                            RESPONSE_CACHE_MISSES_KEY))
+    return {
+        'hits': stats.get(RESPONSE_CACHE_HITS_KEY, 0),
+        'misses': stats.get(RESPONSE_CACHE_MISSES_KEY, 0),
+    }
+
+
+def reset_response_cache_stats():
+    cache.delete_many((RESPONSE_CACHE_HITS_KEY, RESPONSE_CACHE_MISSES_KEY))
@@ -1,5 +1,227 @@
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination,
+    CursorPagination,
+    PageNumberPagination,
+    _reverse_ordering,
+)
+
+from api.filters import RECIPE_ORDERINGS, SEARCH_ORDERING
 
 
 class PageNumberLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация по всем полям сортировки. DRF ставит в курсор
+    только первое поле и пропускает записи с одинаковым значением через
+    OFFSET, а здесь курсор хранит значения всех полей и следующая
+    страница отбирается условием (a, b) < (x, y). Последним полем
+    сортировки должно быть уникальное поле, например id.
+    """
+
+    position_separator = '|'
+
+    def _get_position_from_instance(self, instance, ordering):
+        return self.position_separator.join(
+            str(getattr(instance, order.lstrip('-'))) for order in ordering
+        )
+
+    def get_position_field(self, queryset, name):
+        """Поле модели или аннотации queryset, например rank поиска."""
+
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def parse_position(self, queryset, position):
+        values = position.split(self.position_separator)
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [
+                self.get_position_field(
+                    queryset, order.lstrip('-')
+                ).to_python(value)
+                for order, value in zip(self.ordering, values)
+            ]
+        except ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def keyset_filter(self, queryset, position, reverse):
+        """
+        Условие для записей после позиции курсора в порядке обхода.
+        Нестрогое сравнение по первому полю дублирует условие, чтобы
+        PostgreSQL мог пройти по индексу диапазоном.
+        """
+
+        values = self.parse_position(queryset, position)
+        condition = Q()
+        equal = Q()
+        for order, value in zip(self.ordering, values):
+            field = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        field = self.ordering[0].lstrip('-')
+        lookup = 'lte' if self.ordering[0].startswith('-') != reverse else (
+            'gte'
+        )
+        return Q(**{f'{field}__{lookup}': values[0]}) & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Повторяет CursorPagination.paginate_queryset, заменяя фильтр
+        по первому полю сортировки на keyset_filter.
+        """
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(
+                self.keyset_filter(queryset, current_position, reverse)
+            )
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+        self.update_positions(results, offset, reverse, current_position)
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def update_positions(self, results, offset, reverse, current_position):
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+
+class RecipeCursorPagination(KeysetCursorPagination):
+    """
+    Курсор по сортировке из ordering. При поиске без ordering рецепты
+    идут по релевантности, поэтому rank тоже входит в курсор.
+    """
+
+    page_size_query_param = 'limit'
+    ordering = RECIPE_ORDERINGS['new']
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering')
+        if ordering in RECIPE_ORDERINGS:
+            return RECIPE_ORDERINGS[ordering]
+        if 'rank' in queryset.query.annotations:
+            return SEARCH_ORDERING
+        return self.ordering
+
+
+class HeadCachedCursorPagination(RecipeCursorPagination):
+    """
+    Курсорная пагинация, которая кеширует id записей первой страницы.
+    Ключ кеша строит view.get_head_page_cache_key(), поэтому при
+    попадании в кеш тяжелый запрос выборки заменяется поиском по pk.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        key = view.get_head_page_cache_key()
+        cached = cache.get(key)
+        if cached is None:
+            page = super().paginate_queryset(queryset, request, view)
+            if page is not None:
+                cache.set(key,
+                          ([obj.pk for obj in page], self.has_next,
+                           getattr(self, 'next_position', None)),
+                          settings.FEED_CACHE_TIMEOUT)
+            return page
+        pks, has_next, next_position = cached
+        page = super().paginate_queryset(queryset.filter(pk__in=pks),
+                                         request, view)
+        self.has_next, self.next_position = has_next, next_position
+        return page
+
+
+class UserCursorPagination(CursorPagination):
+    page_size_query_param = 'limit'
+    ordering = ('-id',)
+
+
+class CursorOrPageNumberPagination(BasePagination):
+    """
+    Постраничная разбивка по номеру страницы, а при переданном
+    cursor или pagination=cursor - по курсору без подсчета записей.
+    """
+
+    cursor_pagination_class = RecipeCursorPagination
+    page_number_pagination_class = PageNumberLimitPagination
+
+    def __init__(self):
+        self.paginator = self.page_number_pagination_class()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_class = self.cursor_pagination_class
+        if (cursor_class.cursor_query_param in request.query_params
+                or request.query_params.get('pagination') == 'cursor'):
+            self.paginator = cursor_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return (
+            self.page_number_pagination_class()
+            .get_schema_operation_parameters(view)
+            + self.cursor_pagination_class()
+            .get_schema_operation_parameters(view)
+        )
+
+
+class UserCursorOrPageNumberPagination(CursorOrPageNumberPagination):
+    cursor_pagination_class = UserCursorPagination
@@ -0,0 +1,178 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from api.mixins import get_response_cache_stats
+
+logger = logging.getLogger(__name__)
+
+DUPLICATES_LIMIT = 5
+SQL_LOG_LENGTH = 300
+PERCENTILES = (50, 90, 99)
+METRICS = ('total', 'db', 'queries', 'view', 'render', 'size')
+
+
+def elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def percentile(values, rank):
+    """Перцентиль по методу ближайшего ранга для отсортированных values."""
+
+    index = max(0, -(-len(values) * rank // 100) - 1)
+    return values[index]
+
+
+class QueryRecorder:
+    """
+    Обертка для connection.execute_wrapper: считает запросы к базе,
+    их суммарное время и повторы одного и того же SQL.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += elapsed_ms(start)
+            self.count += 1
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        return [(sql, count) for sql, count
+                in self.statements.most_common(DUPLICATES_LIMIT)
+                if count > 1]
+
+
+class RouteStats:
+    """
+    Последние замеры запросов по маршрутам в памяти процесса.
+    Для каждого маршрута хранится не больше PROFILING_SAMPLES замеров.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(self._new_samples)
+
+    @staticmethod
+    def _new_samples():
+        return deque(maxlen=settings.PROFILING_SAMPLES)
+
+    def add(self, route, sample):
+        with self._lock:
+            self._samples[route].append(sample)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        """Число замеров и перцентили каждой метрики по маршрутам."""
+
+        with self._lock:
+            samples = {route: list(values)
+                       for route, values in self._samples.items()}
+        result = {}
+        for route, values in sorted(samples.items()):
+            result[route] = {'count': len(values)}
+            for position, metric in enumerate(METRICS):
+                ordered = sorted(value[position] for value in values)
+                result[route][metric] = {
+                    f'p{rank}': round(percentile(ordered, rank), 2)
+                    for rank in PERCENTILES
+                }
+                result[route][metric]['max'] = round(ordered[-1], 2)
+        return result
+
+
+route_stats = RouteStats()
+
+
+def profiling_summary():
+    return {
+        'enabled': settings.PROFILING_ENABLED,
+        'pid': os.getpid(),
+        'routes': route_stats.summary(),
+        'response_cache': get_response_cache_stats(),
+    }
+
+
+class ProfilingMiddleware:
+    """
+    Замеряет время обработки запроса, число и время запросов к базе,
+    время работы представления и отрисовки ответа, размер ответа.
+    Отдает замеры в заголовке Server-Timing, копит их по маршрутам
+    и пишет в лог медленные запросы с повторяющимся SQL.
+    Подключается настройкой PROFILING_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._profiling = {'view': 0.0, 'render': 0.0}
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(recorder)
+                )
+            response = self.get_response(request)
+        total = elapsed_ms(start)
+        self.record(request, response, recorder, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._profiling['view_start'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        timings = request._profiling
+        timings['view'] = elapsed_ms(timings.pop('view_start'))
+        start = time.perf_counter()
+
+        def stop_render(response):
+            timings['render'] = elapsed_ms(start)
+
+        response.add_post_render_callback(stop_render)
+        return response
+
+    def record(self, request, response, recorder, total):
+        timings = request._profiling
+        if 'view_start' in timings:
+            timings['view'] = elapsed_ms(timings.pop('view_start'))
+        size = 0 if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={recorder.duration:.1f};desc="{recorder.count} queries"',
+            f'view;dur={timings["view"]:.1f}',
+            f'render;dur={timings["render"]:.1f}',
+            f'total;dur={total:.1f}',
+        ))
+
+        match = request.resolver_match
+        route = f'{request.method} {match.view_name if match else "-"}'
+        route_stats.add(route, (total, recorder.duration, recorder.count,
+                                timings['view'], timings['render'], size))
+        if total >= settings.PROFILING_SLOW_REQUEST_MS:
+            self.log_slow_request(request, route, recorder, total)
+
+    def log_slow_request(self, request, route, recorder, total):
+        lines = [f'{count}x {sql[:SQL_LOG_LENGTH]}'
+                 for sql, count in recorder.duplicates()]
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.0f мс, запросов к базе %d '
+            '(%.0f мс). Повторяющиеся запросы:\n%s',
+            request.method, request.get_full_path(), route, total,
+            recorder.count, recorder.duration, '\n'.join(lines) or '-'
+        )
@@ -0,0 +1,95 @@
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Value
+
+from recipes.cache import get_user_relations_version
+from recipes.models import Recipe
+from users.models import Follow
+
+USER_RELATIONS_KEY = 'users:{}:relations:{}'
+RELATION_KINDS = ('favorite', 'shoppingcart', 'follow')
+
+
+def load_user_relations(user):
+    """
+    Одним запросом загружает id рецептов из избранного и списка покупок
+    пользователя и id авторов, на которых он подписан.
+    """
+
+    relations = {kind: array('Q') for kind in RELATION_KINDS}
+    queries = [
+        relation.through.objects.filter(user=user).annotate(
+            kind=Value(kind)
+        ).values_list('kind', 'recipe_id')
+        for kind, relation in (('favorite', Recipe.favorite),
+                               ('shoppingcart', Recipe.shoppingcart))
+    ]
+    queries.append(
+        Follow.objects.filter(user=user).annotate(
+            kind=Value('follow')
+        ).values_list('kind', 'author_id')
+    )
+    first, *rest = (query.order_by() for query in queries)
+    for kind, pk in first.union(*rest, all=True):
+        relations[kind].append(pk)
+    return relations
+
+
+class UserRelations:
+    """
+    Избранное, список покупок и подписки пользователя в виде множеств id.
+    Загружаются при первом обращении: из кеша по версии связей
+    пользователя или одним запросом к базе. Кеш между запросами
+    отключается нулевым USER_RELATIONS_CACHE_TIMEOUT.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._sets = None
+
+    def _fetch(self):
+        timeout = settings.USER_RELATIONS_CACHE_TIMEOUT
+        if not timeout:
+            return load_user_relations(self.user)
+        key = USER_RELATIONS_KEY.format(
+            self.user.pk, get_user_relations_version(self.user.pk)
+        )
+        relations = cache.get(key)
+        if relations is None:
+            relations = load_user_relations(self.user)
+            cache.set(key, relations, timeout)
+        return relations
+
+    def _load(self, kind):
+        if self._sets is None:
+            if self.user.is_authenticated:
+                self._sets = {kind: frozenset(pks)
+                              for kind, pks in self._fetch().items()}
+            else:
+                self._sets = dict.fromkeys(RELATION_KINDS, frozenset())
+        return self._sets[kind]
+
+    @property
+    def following(self):
+        return self._load('follow')
+
+    def is_favorited(self, recipe_id):
+        return recipe_id in self._load('favorite')
+
+    def is_in_shopping_cart(self, recipe_id):
+        return recipe_id in self._load('shoppingcart')
+
+    def is_subscribed(self, author_id):
+        return author_id in self._load('follow')
+
+
+def get_user_relations(request):
+    """Связи текущего пользователя, общие для всех сериализаторов запроса."""
+
+    relations = getattr(request, '_user_relations', None)
+    if relations is None or relations.user is not request.user:
+        relations = UserRelations(request.user)
+        request._user_relations = relations
+    return relations
@@ -1,12 +1,27 @@
 import base64
-
-from django.core.files.base import ContentFile
+import binascii
+import io
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (
+    InMemoryUploadedFile,
+    TemporaryUploadedFile,
+)
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 
+from api.documents import represent_recipes
+from api.fields import BulkPrimaryKeyRelatedField, resolve_pks
+from api.relations import get_user_relations
+from recipes.cache import invalidate_recipe_ingredients
 from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
-from users.models import Follow, User
+from users.models import User
+
+RECIPE_MIN_FIELDS = ('id', 'name', 'image', 'thumbnails', 'cooking_time')
+RECIPES_BATCH_MAX_SIZE = 500
 
 
 class CustomUserSerializer(UserSerializer):
@@ -26,10 +41,11 @@ class CustomUserSerializer(UserSerializer):
     def get_is_subscribed(self, obj):
         current_user = self.context['request'].user
         if current_user.is_authenticated:
-            is_subscribed = Follow.objects.filter(
-                author=obj, user=current_user
-            ).exists()
-            return is_subscribed
+            if hasattr(obj, 'is_subscribed'):
+                return obj.is_subscribed
+            return get_user_relations(
+                self.context['request']
+            ).is_subscribed(obj.pk)
 
 
 class CreateUserSerializer(UserCreateSerializer):
@@ -61,14 +77,31 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class RecipeIngredientListSerializer(serializers.ListSerializer):
+    """Проверяет все ингредиенты рецепта одним запросом."""
+
+    def to_internal_value(self, data):
+        ingredients_data = super().to_internal_value(data)
+        ingredients = resolve_pks(
+            Ingredient.objects.all(),
+            [ingredient_data['id'] for ingredient_data in ingredients_data],
+            'Ингредиенты не найдены: {}',
+            self.context.get('known_objects', {}).get(Ingredient)
+        )
+        for ingredient_data, ingredient in zip(ingredients_data, ingredients):
+            ingredient_data['id'] = ingredient
+        return ingredients_data
+
+
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
     """Сериализатор для записи ингредиентов в рецепт."""
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
 
     class Meta:
         model = IngredientInRecipe
         fields = ('id', 'amount')
+        list_serializer_class = RecipeIngredientListSerializer
 
 
 class RecipeIngredientReadSerializer(serializers.ModelSerializer):
@@ -85,6 +118,33 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class ThumbnailField(serializers.ReadOnlyField):
+    """
+    Ссылка на наименьшую уменьшенную копию картинки рецепта. Пока копии
+    не собраны для текущей картинки, отдается сама картинка. С absolute
+    ссылка строится от адреса запроса, как у ImageField.
+    """
+
+    def __init__(self, absolute=False, **kwargs):
+        self.absolute = absolute
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def get_url(self, recipe):
+        thumbnails = recipe.thumbnails
+        widths = [width for width in thumbnails if width.isdigit()]
+        if not widths or thumbnails.get('source') != recipe.image.name:
+            return recipe.image.url
+        return default_storage.url(thumbnails[min(widths, key=int)])
+
+    def to_representation(self, recipe):
+        url = self.get_url(recipe)
+        request = self.context.get('request')
+        if self.absolute and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     """Сериализатор для чтения рецепта."""
 
@@ -96,6 +156,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         source='ingredientinrecipe_set',
     )
     image = serializers.URLField(source='image.url')
+    image_thumb = ThumbnailField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -109,32 +170,133 @@ class RecipeReadSerializer(serializers.ModelSerializer):
                   'is_in_shopping_cart',
                   'name',
                   'image',
+                  'image_thumb',
                   'text',
                   'cooking_time')
 
     def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        return obj.favorite.filter(id=user.id).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return get_user_relations(
+            self.context['request']
+        ).is_favorited(obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        return obj.shoppingcart.filter(id=user.id).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return get_user_relations(
+            self.context['request']
+        ).is_in_shopping_cart(obj.pk)
+
+
+class RecipeDocumentListSerializer(serializers.ListSerializer):
+    """Список рецептов из заранее собранных документов."""
+
+    def to_representation(self, data):
+        return represent_recipes(list(data), RecipeReadSerializer,
+                                 self.context)
+
+
+class RecipeDocumentSerializer(RecipeReadSerializer):
+    """
+    Сериализатор для чтения рецептов из документов в кеше.
+    Документ собирается RecipeReadSerializer один раз на версию рецепта,
+    при выдаче в нем меняются только флаги текущего пользователя.
+    """
+
+    class Meta(RecipeReadSerializer.Meta):
+        list_serializer_class = RecipeDocumentListSerializer
+
+    def to_representation(self, instance):
+        return represent_recipes([instance], RecipeReadSerializer,
+                                 self.context)[0]
+
+
+BASE64_HEADER_SEPARATOR = ';base64,'
+BASE64_CHUNK_SIZE = 64 * 1024
+BASE64_WHITESPACE = ' \t\n\r\x0b\x0c'
+BASE64_STRIP_TABLE = str.maketrans('', '', BASE64_WHITESPACE)
+
+
+def base64_decoded_size(data, offset):
+    """
+    Оценка размера раскодированных данных без учета пробелов и
+    переводов строк, которыми base64 в стиле MIME разбит на строки.
+    """
+
+    whitespace = sum(data.count(char, offset) for char in BASE64_WHITESPACE)
+    return (len(data) - offset - whitespace) * 3 // 4
+
+
+def decode_base64_file(data, offset, size, name, content_type):
+    """
+    Декодирует base64 частями, начиная с offset, в загруженный файл.
+    Пробелы и переводы строк отбрасываются, а хвост части, не кратный
+    четырем символам, переносится в следующую. Большие файлы пишутся
+    во временный файл на диске, поэтому раскодированная картинка
+    целиком в памяти не держится.
+    """
+
+    if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        upload = TemporaryUploadedFile(name, content_type, size, None)
+    else:
+        upload = InMemoryUploadedFile(io.BytesIO(), None, name,
+                                      content_type, size, None)
+    rest = ''
+    try:
+        for start in range(offset, len(data), BASE64_CHUNK_SIZE):
+            chunk = rest + data[start:start + BASE64_CHUNK_SIZE].translate(
+                BASE64_STRIP_TABLE
+            )
+            end = len(chunk) - len(chunk) % 4
+            upload.write(base64.b64decode(chunk[:end], validate=True))
+            rest = chunk[end:]
+        if rest:
+            raise binascii.Error('Incorrect padding')
+    except binascii.Error:
+        upload.close()
+        raise serializers.ValidationError('Некорректная кодировка картинки')
+    upload.size = upload.tell()
+    upload.seek(0)
+    return upload
 
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+            offset = data.find(BASE64_HEADER_SEPARATOR)
+            if offset == -1:
+                raise serializers.ValidationError(
+                    'Картинка должна быть передана в base64'
+                )
+            size = base64_decoded_size(
+                data, offset + len(BASE64_HEADER_SEPARATOR)
+            )
+            if size > settings.RECIPE_IMAGE_MAX_SIZE:
+                raise serializers.ValidationError(
+                    'Размер картинки не должен превышать '
+                    f'{settings.RECIPE_IMAGE_MAX_SIZE} байт'
+                )
+            content_type = data[len('data:'):offset]
+            ext = content_type.split('/')[-1]
+            data = decode_base64_file(data,
+                                      offset + len(BASE64_HEADER_SEPARATOR),
+                                      size,
+                                      'temp.' + ext,
+                                      content_type)
+        image = super().to_internal_value(data)
+        if max(image.image.size) > settings.RECIPE_IMAGE_MAX_DIMENSION:
+            raise serializers.ValidationError(
+                'Сторона картинки не должна превышать '
+                f'{settings.RECIPE_IMAGE_MAX_DIMENSION} пикселей'
+            )
+        return image
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     """Сериализатор для записи рецепта."""
 
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = BulkPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
     ingredients = RecipeIngredientWriteSerializer(many=True)
     image = Base64ImageField()
 
@@ -176,17 +338,64 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         recipe.tags.set(tags)
         return recipe
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """
+        Сравнивает новые ингредиенты с сохраненными и применяет только
+        разницу: добавление, изменение количества и удаление.
+        """
+
+        existing = {
+            item.ingredient_id: item
+            for item in recipe.ingredientinrecipe_set.all()
+        }
+        amounts = {
+            ingredient_data['id'].id: ingredient_data['amount']
+            for ingredient_data in ingredients_data
+        }
+        to_create, to_update = [], []
+        for ingredient_id, amount in amounts.items():
+            item = existing.get(ingredient_id)
+            if item is None:
+                to_create.append(IngredientInRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                ))
+            elif item.amount != amount:
+                item.amount = amount
+                to_update.append(item)
+        to_delete = [item.id for ingredient_id, item in existing.items()
+                     if ingredient_id not in amounts]
+
+        if to_delete:
+            IngredientInRecipe.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            IngredientInRecipe.objects.bulk_update(to_update, ('amount',))
+        if to_create:
+            IngredientInRecipe.objects.bulk_create(to_create)
+        if to_create or to_delete:
+            invalidate_recipe_ingredients()
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
+        ingredients_data = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
         recipe = super().update(instance, validated_data)
-        recipe.ingredients.clear()
-        self.create_ingredient(recipe, ingredients_data)
-        recipe.tags.set(tags)
+        if ingredients_data is not None:
+            self.update_ingredients(recipe, ingredients_data)
+        if tags is not None:
+            recipe.tags.set(tags)
         return recipe
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch(
+                'ingredientinrecipe_set',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
         context = {'request': self.context['request']}
         return RecipeReadSerializer(instance, context=context).data
 
@@ -194,9 +403,46 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 class RecipeMinSerializer(serializers.ModelSerializer):
     """Сериализатор для минимальной информации о рецепте."""
 
+    image_thumb = ThumbnailField(absolute=True)
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_thumb', 'cooking_time')
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список рецептов для пакетного добавления и удаления."""
+
+    recipes = BulkPrimaryKeyRelatedField(
+        many=True,
+        allow_empty=False,
+        queryset=Recipe.objects.only(*RECIPE_MIN_FIELDS)
+    )
+
+    def validate_recipes(self, recipes):
+        if len(recipes) > RECIPES_BATCH_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Не больше {RECIPES_BATCH_MAX_SIZE} рецептов за раз'
+            )
+        return recipes
+
+
+class RecipeMatchSerializer(RecipeMinSerializer):
+    """
+    Сериализатор рецептов, подобранных по имеющимся ингредиентам,
+    с долей имеющихся и списком недостающих ингредиентов.
+    """
+
+    coverage = serializers.FloatField(read_only=True)
+    missing_count = serializers.IntegerField(read_only=True)
+    missing_ingredients = serializers.ListField(
+        child=serializers.IntegerField(), read_only=True
+    )
+
+    class Meta(RecipeMinSerializer.Meta):
+        fields = RecipeMinSerializer.Meta.fields + (
+            'coverage', 'missing_count', 'missing_ingredients'
+        )
 
 
 class UserFollowSerializer(CustomUserSerializer):
@@ -204,7 +450,6 @@ class UserFollowSerializer(CustomUserSerializer):
     Сериализатор для пользователей с дополнительной информацией
     о подписках.
     """
-    recipes_count = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
 
     class Meta:
@@ -214,6 +459,8 @@ class UserFollowSerializer(CustomUserSerializer):
         )
 
     def get_recipes(self, obj):
+        if hasattr(obj, 'recipes_preview'):
+            return RecipeMinSerializer(obj.recipes_preview, many=True).data
         request = self.context['request']
         limit = int(request.GET.get('recipes_limit', 0))
         if limit > 0:
@@ -221,6 +468,3 @@ class UserFollowSerializer(CustomUserSerializer):
         else:
             queryset = obj.recipes.all()
         return RecipeMinSerializer(queryset, many=True).data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
@@ -0,0 +1,1069 @@
+import base64
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api import documents
+from api.profiling import METRICS, PERCENTILES, route_stats
+from api.serializers import Base64ImageField, RecipeMinSerializer
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from recipes.pantry_index import PantryIndex, pantry_index
+from recipes.search import update_search_vectors
+from users.models import Follow, User
+
+RECIPES_URL = '/api/recipes/'
+RECIPES_COUNT = 8
+SORT_NODES = ('Sort', 'Incremental Sort')
+
+
+class RecipeTestCase(TestCase):
+    """Пользователи, справочники и рецепты для тестов API рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Иван', last_name='Читатель', password='pass-12345'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Анна', last_name='Автор', password='pass-12345'
+        )
+        cls.tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (('Завтрак', '#E26C2D', 'breakfast'),
+                                      ('Обед', '#49B64E', 'lunch'))
+        ]
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Продукт {number}', measurement_unit='г')
+            for number in range(5)
+        )
+        cls.recipes = []
+        for number in range(RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                author=cls.author, image='recipes/test.png'
+            )
+            recipe.tags.set(cls.tags)
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=number + 1)
+                for ingredient in cls.ingredients[:3]
+            )
+            cls.recipes.append(recipe)
+        cls.recipes[0].favorite.add(cls.user)
+        cls.recipes[1].shoppingcart.add(cls.user)
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, response, link='next'):
+        """Проходит курсорные страницы по ссылкам next или previous."""
+
+        pages = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([recipe['id'] for recipe in response.data['results']])
+            if not response.data[link]:
+                return pages, response
+            response = self.client.get(response.data[link])
+
+
+class RecipeReadQueriesTest(RecipeTestCase):
+    """Число запросов при чтении рецептов не зависит от их числа."""
+
+    LIST_QUERIES = 7
+    DETAIL_QUERIES = 6
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        for limit in (2, RECIPES_COUNT):
+            with self.subTest(limit=limit):
+                cache.clear()
+                with self.assertNumQueries(self.LIST_QUERIES):
+                    response = self.client.get(RECIPES_URL,
+                                               {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_list_flags(self):
+        response = self.client.get(RECIPES_URL,
+                                   {'limit': RECIPES_COUNT})
+        recipes = {recipe['id']: recipe
+                   for recipe in response.data['results']}
+        self.assertTrue(recipes[self.recipes[0].pk]['is_favorited'])
+        self.assertFalse(recipes[self.recipes[1].pk]['is_favorited'])
+        self.assertTrue(recipes[self.recipes[1].pk]['is_in_shopping_cart'])
+        self.assertTrue(all(recipe['author']['is_subscribed']
+                            for recipe in recipes.values()))
+
+    def test_detail_queries(self):
+        with self.assertNumQueries(self.DETAIL_QUERIES):
+            response = self.client.get(f'{RECIPES_URL}{self.recipes[0].pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 3)
+        self.assertEqual(len(response.data['tags']), 2)
+
+
+class UserRelationsCacheTest(RecipeTestCase):
+    """Флаги пользователя обновляются после изменения его связей."""
+
+    def test_follow_outside_api_resets_cached_relations(self):
+        follower = User.objects.create_user(
+            username='follower', email='follower@example.com',
+            first_name='Олег', last_name='Подписчик', password='pass-12345'
+        )
+        self.client.force_authenticate(follower)
+        url = f'{RECIPES_URL}{self.recipes[0].pk}/'
+        response = self.client.get(url)
+        self.assertFalse(response.data['author']['is_subscribed'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(user=follower, author=self.author)
+        response = self.client.get(url)
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+
+class ResponseCacheStatsTest(RecipeTestCase):
+    """Счетчики кеша ответов для анонимов видны в /api/profiling/."""
+
+    def test_profiling_reports_response_cache(self):
+        url = f'{RECIPES_URL}{self.recipes[0].pk}/'
+        anonymous = APIClient()
+        for _ in range(3):
+            anonymous.get(url)
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com',
+            first_name='Админ', last_name='Админов', password='pass-12345'
+        )
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/profiling/')
+        self.assertEqual(response.data['response_cache'],
+                         {'hits': 2, 'misses': 1})
+        self.client.delete('/api/profiling/')
+        response = self.client.get('/api/profiling/')
+        self.assertEqual(response.data['response_cache'],
+                         {'hits': 0, 'misses': 0})
+
+
+class ShoppingCartUnitsTest(RecipeTestCase):
+    """В основные единицы переводятся только килограммы и литры."""
+
+    def test_download_shopping_cart_units(self):
+        recipe = Recipe.objects.create(
+            name='Хумус', text='Описание', cooking_time=10,
+            author=self.author, image='recipes/test.png'
+        )
+        for name, unit, amount in (('паста хариса', 'ст. л.', 2),
+                                   ('Мука', 'кг', 1),
+                                   ('мука', 'г', 200)):
+            ingredient = Ingredient.objects.create(name=name,
+                                                   measurement_unit=unit)
+            IngredientInRecipe.objects.create(recipe=recipe,
+                                              ingredient=ingredient,
+                                              amount=amount)
+        recipe.shoppingcart.add(self.user)
+        response = self.client.get(f'{RECIPES_URL}download_shopping_cart/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertIn('паста хариса: 2ст. л.', lines)
+        self.assertEqual(
+            [line for line in lines if line.lower().startswith('мука')],
+            ['Мука: 1200г']
+        )
+
+
+class ThumbnailFieldTest(RecipeTestCase):
+    """Ссылка image_thumb соответствует текущей картинке рецепта."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[0]
+        self.recipe.thumbnails = {
+            'source': 'recipes/old.png',
+            '128': 'recipes/thumbs/old_128.webp',
+        }
+
+    def serialize(self, request=None):
+        context = {'request': request} if request else {}
+        return RecipeMinSerializer(self.recipe, context=context).data
+
+    def test_stale_thumbnails_fall_back_to_image(self):
+        data = self.serialize()
+        self.assertEqual(data['image_thumb'], self.recipe.image.url)
+        self.recipe.thumbnails['source'] = self.recipe.image.name
+        data = self.serialize()
+        self.assertTrue(data['image_thumb'].endswith('old_128.webp'))
+
+    def test_thumbnail_is_absolute_with_request(self):
+        data = self.serialize(APIRequestFactory().get('/api/recipes/cook/'))
+        self.assertTrue(data['image'].startswith('http://testserver/'))
+        self.assertEqual(data['image_thumb'], data['image'])
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+    """Картинка в base64 с переводами строк раскодируется частями."""
+
+    def setUp(self):
+        buffer = io.BytesIO()
+        Image.effect_noise((32, 32), 64).save(buffer, 'PNG')
+        self.payload = buffer.getvalue()
+
+    def decode(self, encoded):
+        upload = Base64ImageField().to_internal_value(
+            'data:image/png;base64,' + encoded
+        )
+        return upload.read()
+
+    @mock.patch('api.serializers.BASE64_CHUNK_SIZE', 10)
+    def test_mime_base64(self):
+        encoded = base64.encodebytes(self.payload).decode()
+        for data in (encoded, encoded.replace('\n', '\r\n')):
+            with self.subTest(crlf='\r' in data):
+                self.assertEqual(self.decode(data), self.payload)
+
+    def test_size_check_ignores_newlines(self):
+        encoded = base64.encodebytes(self.payload).decode()
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=len(self.payload) + 2):
+            self.assertEqual(self.decode(encoded), self.payload)
+
+
+def image_data_url():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), '#E26C2D').save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+class RecipeWriteIdsTest(RecipeTestCase):
+    """Ключи тегов и ингредиентов проверяются так же, как по одному."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.author)
+
+    def post(self, tags, ingredient_id):
+        return self.client.post(RECIPES_URL, {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': image_data_url(),
+            'tags': tags,
+            'ingredients': [{'id': ingredient_id, 'amount': 1}],
+        }, format='json')
+
+    def test_invalid_tag_ids(self):
+        for tags in ([None, 99999], [True], ['abc'], [[1]], [99999, 100]):
+            with self.subTest(tags=tags):
+                response = self.post(tags, self.ingredients[0].pk)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('tags', response.data)
+
+    def test_invalid_ingredient_ids(self):
+        for ingredient_id in (None, True, 'abc', 99999):
+            with self.subTest(ingredient_id=ingredient_id):
+                response = self.post([self.tags[0].pk], ingredient_id)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('ingredients', response.data)
+
+    def test_string_ids(self):
+        response = self.post([str(self.tags[0].pk)],
+                             str(self.ingredients[0].pk))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([tag['id'] for tag in response.data['tags']],
+                         [self.tags[0].pk])
+
+
+class RecipeUpdateQueriesTest(RecipeTestCase):
+    """PATCH рецепта меняет только отличающиеся строки состава."""
+
+    NOOP_QUERIES = 12
+    ONE_INGREDIENT_QUERIES = NOOP_QUERIES + 1
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.author)
+        self.recipe = self.recipes[0]
+        self.url = f'{RECIPES_URL}{self.recipe.pk}/'
+
+    def get_payload(self, amounts=None):
+        ingredients = {
+            item.ingredient_id: item.amount
+            for item in self.recipe.ingredientinrecipe_set.all()
+        }
+        ingredients.update(amounts or {})
+        return {
+            'name': self.recipe.name,
+            'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [{'id': pk, 'amount': amount}
+                            for pk, amount in ingredients.items()],
+        }
+
+    def item_ids(self):
+        return dict(self.recipe.ingredientinrecipe_set.values_list(
+            'ingredient_id', 'id'
+        ))
+
+    def test_noop_update_queries(self):
+        before = self.item_ids()
+        payload = self.get_payload()
+        with self.assertNumQueries(self.NOOP_QUERIES):
+            response = self.client.patch(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.item_ids(), before)
+
+    def test_one_ingredient_update_queries(self):
+        before = self.item_ids()
+        changed = self.ingredients[0].pk
+        payload = self.get_payload({changed: 100})
+        with self.assertNumQueries(self.ONE_INGREDIENT_QUERIES):
+            response = self.client.patch(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.item_ids(), before)
+        self.assertEqual(
+            self.recipe.ingredientinrecipe_set.get(
+                ingredient_id=changed
+            ).amount,
+            100
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'План запроса проверяется только на PostgreSQL')
+class RecipeListPlanTest(RecipeTestCase):
+    """
+    Страница списка с фильтрами читается по индексу в порядке выдачи,
+    без сортировки строк рецептов. Последовательное чтение и сортировка
+    запрещаются, чтобы на маленькой базе планировщик не выбрал их по
+    стоимости: если план без Sort существует, он будет выбран.
+    """
+
+    def get_page_query(self, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(RECIPES_URL, params)
+        self.assertEqual(response.status_code, 200)
+        return next(
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT "recipes_recipe"."id"')
+            and query['sql'].rsplit(' LIMIT ', 1)[-1].isdigit()
+        )
+
+    def get_plan_nodes(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            nodes = [cursor.fetchone()[0][0]['Plan']]
+        for node in nodes:
+            nodes.extend(node.get('Plans', ()))
+        return nodes
+
+    def test_filters_do_not_sort_recipes(self):
+        for params in ({'tags': ['breakfast', 'lunch'], 'limit': 2},
+                       {'author': self.author.pk, 'limit': 2},
+                       {'tags': 'lunch', 'pagination': 'cursor', 'limit': 2},
+                       {'author': self.author.pk, 'pagination': 'cursor',
+                        'limit': 2}):
+            with self.subTest(params=params):
+                nodes = self.get_plan_nodes(self.get_page_query(params))
+                self.assertFalse(
+                    [node for node in nodes
+                     if node['Node Type'] in SORT_NODES],
+                    nodes[0]
+                )
+
+
+@override_settings(PANTRY_INDEX_BACKGROUND_REBUILD=False)
+class PantryMatchTest(TestCase):
+    """Подбор рецептов по ингредиентам совпадает с перебором множеств."""
+
+    COOK_URL = f'{RECIPES_URL}cook/'
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(1)
+        cls.user = User.objects.create_user(
+            username='cook', email='cook@example.com',
+            first_name='Анна', last_name='Повар', password='pass-12345'
+        )
+        cls.ingredients = [
+            ingredient.pk for ingredient in Ingredient.objects.bulk_create(
+                Ingredient(name=f'Продукт {number}', measurement_unit='г')
+                for number in range(12)
+            )
+        ]
+        cls.compositions = {}
+        for number in range(40):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                author=cls.user, image='recipes/test.png'
+            )
+            composition = set(rng.sample(cls.ingredients, rng.randint(1, 6)))
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient_id=pk, amount=1)
+                for pk in composition
+            )
+            cls.compositions[recipe.pk] = composition
+        cls.queries = [set(rng.sample(cls.ingredients, size))
+                       for size in (1, 3, 6, 12)]
+        cls.queries.append(next(iter(cls.compositions.values())))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expected(self, available, max_missing=None):
+        rows = []
+        for pk, composition in self.compositions.items():
+            have = len(composition & available)
+            missing = len(composition) - have
+            if not have or (max_missing is not None
+                            and missing > max_missing):
+                continue
+            rows.append((-have / len(composition), missing, -pk,
+                         sorted(composition - available)))
+        return [
+            {'id': -pk, 'coverage': round(-coverage, 3),
+             'missing_count': missing, 'missing_ingredients': ingredients}
+            for coverage, missing, pk, ingredients in sorted(rows)
+        ]
+
+    def cook(self, available, max_missing=None, limit=7):
+        params = {'ingredients': sorted(available), 'limit': limit}
+        if max_missing is not None:
+            params['max_missing'] = max_missing
+        rows, page = [], 1
+        while True:
+            response = self.client.get(self.COOK_URL, {**params,
+                                                       'page': page})
+            self.assertEqual(response.status_code, 200)
+            rows.extend(
+                {key: row[key] for key in ('id', 'coverage', 'missing_count',
+                                           'missing_ingredients')}
+                for row in response.data['results']
+            )
+            if not response.data['next']:
+                return response.data['count'], rows
+            page += 1
+
+    def test_matches_brute_force(self):
+        for available in self.queries:
+            for max_missing in (None, 0, 2):
+                with self.subTest(available=sorted(available),
+                                  max_missing=max_missing):
+                    expected = self.expected(available, max_missing)
+                    count, rows = self.cook(available, max_missing)
+                    self.assertEqual(count, len(expected))
+                    self.assertEqual(rows, expected)
+
+    def test_full_match_comes_first(self):
+        available = self.queries[-1]
+        _, rows = self.cook(available, max_missing=0, limit=100)
+        self.assertTrue(rows)
+        self.assertTrue(all(row['coverage'] == 1.0 for row in rows))
+
+    def test_page_slices(self):
+        available = set(self.ingredients)
+        expected = self.expected(available)
+        for limit in (1, 3, len(expected), len(expected) + 5):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.cook(available, limit=limit)[1],
+                                 expected)
+
+    def add_ingredient(self, recipe_id, ingredient_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientInRecipe.objects.create(
+                recipe_id=recipe_id, ingredient_id=ingredient_id, amount=1
+            )
+        self.compositions[recipe_id].add(ingredient_id)
+
+    def get_change(self):
+        recipe_id, composition = next(
+            (pk, composition) for pk, composition in self.compositions.items()
+            if len(composition) < len(self.ingredients)
+        )
+        ingredient_id = next(pk for pk in self.ingredients
+                             if pk not in composition)
+        return recipe_id, ingredient_id
+
+    def test_rebuilds_after_ingredients_change(self):
+        available = {self.ingredients[0], self.ingredients[1]}
+        self.cook(available)
+        recipe_id, ingredient_id = self.get_change()
+        self.add_ingredient(recipe_id, ingredient_id)
+        self.assertEqual(self.cook(available | {ingredient_id})[1],
+                         self.expected(available | {ingredient_id}))
+
+    @override_settings(PANTRY_INDEX_BACKGROUND_REBUILD=True)
+    def test_background_rebuild_serves_previous_index(self):
+        available = set(self.ingredients)
+        before = self.expected(available)
+        self.cook(available)
+        recipe_id, ingredient_id = self.get_change()
+        self.add_ingredient(recipe_id, ingredient_id)
+        with mock.patch.object(PantryIndex, '_start_rebuild') as start:
+            self.assertEqual(self.cook(available)[1], before)
+        start.assert_called()
+        pantry_index._rebuild(start.call_args.args[0])
+        self.assertEqual(self.cook(available)[1], self.expected(available))
+
+
+class RecipeRelationActionsTest(RecipeTestCase):
+    """Избранное и список покупок меняются по строкам из RETURNING."""
+
+    def favorites(self, *recipes):
+        return [Recipe.objects.get(pk=recipe.pk).favorites_count
+                for recipe in recipes]
+
+    def is_favorited(self, recipe):
+        return recipe.favorite.filter(pk=self.user.pk).exists()
+
+    def test_single_favorite(self):
+        recipe = self.recipes[2]
+        url = f'{RECIPES_URL}{recipe.pk}/favorite/'
+        before, = self.favorites(recipe)
+        with self.assertNumQueries(5):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], recipe.pk)
+        self.assertEqual(self.favorites(recipe), [before + 1])
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.favorites(recipe), [before + 1])
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(self.favorites(recipe), [before])
+        self.assertFalse(self.is_favorited(recipe))
+
+    def test_single_unknown_recipe(self):
+        for pk in (99999, 'abc'):
+            url = f'{RECIPES_URL}{pk}/favorite/'
+            with self.subTest(pk=pk):
+                self.assertEqual(self.client.post(url).status_code, 404)
+                self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_batch_duplicates_and_present(self):
+        first, second, third = self.recipes[2:5]
+        self.client.post(f'{RECIPES_URL}{first.pk}/favorite/')
+        before = self.favorites(first, second, third)
+        response = self.client.post(
+            f'{RECIPES_URL}favorite/',
+            {'recipes': [second.pk, second.pk, third.pk, first.pk]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [second.pk, third.pk, first.pk])
+        self.assertEqual(self.favorites(first, second, third),
+                         [before[0], before[1] + 1, before[2] + 1])
+
+        response = self.client.delete(
+            f'{RECIPES_URL}favorite/',
+            {'recipes': [second.pk, self.recipes[6].pk, first.pk]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.favorites(first, second, third),
+                         [before[0] - 1, before[1], before[2] + 1])
+        self.assertFalse(self.is_favorited(first))
+        self.assertTrue(self.is_favorited(third))
+
+    def test_batch_unknown_ids(self):
+        recipe = self.recipes[4]
+        for method in (self.client.post, self.client.delete):
+            with self.subTest(method=method.__name__):
+                response = method(f'{RECIPES_URL}shopping_cart/',
+                                  {'recipes': [recipe.pk, 99999]},
+                                  format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(
+                    recipe.shoppingcart.filter(pk=self.user.pk).exists()
+                )
+
+    def test_batch_shopping_cart(self):
+        in_cart, other = self.recipes[1], self.recipes[5]
+        url = f'{RECIPES_URL}shopping_cart/'
+        payload = {'recipes': [in_cart.pk, other.pk]}
+        self.assertEqual(
+            self.client.post(url, payload, format='json').status_code, 201
+        )
+        self.assertEqual(
+            set(self.user.shoppingcart.values_list('pk', flat=True)),
+            {in_cart.pk, other.pk}
+        )
+        self.assertEqual(
+            self.client.delete(url, payload, format='json').status_code, 204
+        )
+        self.assertFalse(self.user.shoppingcart.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeImportExportTest(RecipeTestCase):
+    """Экспорт в NDJSON и обратный импорт через API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.exporter = User.objects.create_user(
+            username='exporter', email='exporter@example.com',
+            first_name='Мария', last_name='Экспорт', password='pass-12345'
+        )
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), '#49B64E').save(buffer, 'PNG')
+        cls.image_bytes = buffer.getvalue()
+        cls.recipe = Recipe(name='Экспорт', text='Описание',
+                            cooking_time=15, author=cls.exporter)
+        cls.recipe.image.save('export.png', ContentFile(cls.image_bytes),
+                              save=False)
+        cls.recipe.save()
+        cls.recipe.tags.set(cls.tags[:1])
+        IngredientInRecipe.objects.create(recipe=cls.recipe,
+                                          ingredient=cls.ingredients[0],
+                                          amount=7)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def export(self, **params):
+        response = self.client.get(f'{RECIPES_URL}export/',
+                                   {'author': self.exporter.pk, **params})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def import_lines(self, body):
+        return self.client.post(f'{RECIPES_URL}import/', body,
+                                content_type='application/x-ndjson')
+
+    def test_url_image_cannot_be_imported(self):
+        body = self.export()
+        record = json.loads(body)
+        self.assertFalse(record['image'].startswith('data:'))
+        response = self.import_lines(body)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(response.data['errors'][0]['line'], 1)
+        self.assertIn('image', response.data['errors'][0]['errors'])
+
+    def test_inline_images_round_trip(self):
+        body = self.export(images='inline')
+        self.assertTrue(json.loads(body)['image'].startswith('data:image/'))
+        with self.captureOnCommitCallbacks():
+            response = self.import_lines(body)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 1, 'errors': []})
+        imported = Recipe.objects.exclude(pk=self.recipe.pk).get(
+            name=self.recipe.name
+        )
+        self.assertEqual(imported.author, self.user)
+        self.assertEqual(
+            (imported.text, imported.cooking_time),
+            (self.recipe.text, self.recipe.cooking_time)
+        )
+        self.assertEqual(list(imported.tags.all()), self.tags[:1])
+        self.assertEqual(
+            list(imported.ingredientinrecipe_set.values_list(
+                'ingredient_id', 'amount'
+            )),
+            [(self.ingredients[0].pk, 7)]
+        )
+        with imported.image.open('rb') as image_file:
+            self.assertEqual(image_file.read(), self.image_bytes)
+
+    def test_malformed_line_reports_parse_error(self):
+        body = '{"name": \n[1, 2]\n' + self.export(images='inline')
+        with self.captureOnCommitCallbacks():
+            response = self.import_lines(body)
+        self.assertEqual(response.data['created'], 1)
+        first, second = response.data['errors']
+        self.assertEqual(first['line'], 1)
+        self.assertTrue(first['errors'].startswith('Некорректный JSON: '))
+        self.assertIn('Expecting value', first['errors'])
+        self.assertEqual(second, {'line': 2,
+                                  'errors': 'Ожидается JSON-объект рецепта'})
+
+
+class RecipeSearchCursorTest(RecipeTestCase):
+    """
+    Курсор поиска идет по релевантности, как и постраничная выдача.
+    Совпадения в названии важнее совпадений в описании, а внутри
+    одинаковой релевантности порядок задают pub_date и id.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for number, recipe in enumerate(cls.recipes[:3]):
+            recipe.name = f'блины {number}'
+            recipe.save(update_fields=('name',))
+        for recipe in cls.recipes[3:6]:
+            recipe.text = 'Тонкие блины'
+            recipe.save(update_fields=('text',))
+        update_search_vectors(*(recipe.pk for recipe in cls.recipes))
+        cls.expected = [recipe.pk for recipe in
+                        cls.recipes[2::-1] + cls.recipes[5:2:-1]]
+
+    def first_page(self, search):
+        return self.client.get(RECIPES_URL, {
+            'search': search, 'pagination': 'cursor', 'limit': 2
+        })
+
+    def assert_search_order(self, search):
+        response = self.client.get(RECIPES_URL,
+                                   {'search': search, 'limit': 100})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            self.expected
+        )
+        pages, _ = self.walk(self.first_page(search))
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual(len(pages), 3)
+
+    def test_cursor_keeps_relevance_order(self):
+        self.assert_search_order('блины')
+
+    def test_previous_pages(self):
+        _, last = self.walk(self.first_page('блины'))
+        pages, _ = self.walk(last, link='previous')
+        self.assertEqual(sum(reversed(pages), []), self.expected)
+
+    def test_explicit_ordering_wins_over_relevance(self):
+        response = self.client.get(RECIPES_URL, {
+            'search': 'блины', 'ordering': 'new',
+            'pagination': 'cursor', 'limit': 100
+        })
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         sorted(self.expected, reverse=True))
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'Полнотекстовый поиск проверяется только на PostgreSQL')
+    def test_full_text_search(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assert_search_order('блинами')
+        self.assertTrue(any('ts_rank' in query['sql'] and '@@' in query['sql']
+                            for query in context.captured_queries))
+
+
+class RecipeCursorTiesTest(RecipeTestCase):
+    """
+    Курсор проходит рецепты с одинаковыми pub_date и popularity
+    без пропусков и повторов в обе стороны, даже когда граница
+    страницы попадает внутрь группы равных значений.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        for number, recipe in enumerate(cls.recipes):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=now - timedelta(days=number // 3),
+                popularity=float(number % 3)
+            )
+        cls.stored = list(Recipe.objects.values('id', 'pub_date',
+                                                'popularity'))
+
+    def expected(self, field):
+        return [row['id'] for row in sorted(
+            self.stored, key=lambda row: (row[field], row['id']),
+            reverse=True
+        )]
+
+    def test_ties_are_not_lost_or_repeated(self):
+        for ordering, field in (('new', 'pub_date'),
+                                ('popular', 'popularity')):
+            for limit in (1, 2, 3):
+                with self.subTest(ordering=ordering, limit=limit):
+                    expected = self.expected(field)
+                    pages, last = self.walk(
+                        self.client.get(RECIPES_URL, {
+                            'ordering': ordering, 'pagination': 'cursor',
+                            'limit': limit
+                        }),
+                        'next'
+                    )
+                    self.assertEqual(sum(pages, []), expected)
+                    self.assertTrue(all(pages))
+                    pages, _ = self.walk(last, 'previous')
+                    self.assertEqual(sum(reversed(pages), []), expected)
+
+
+class SubscriptionCountersTest(RecipeTestCase):
+    """Подписка через API меняет followers_count автора ровно на 1."""
+
+    def followers(self):
+        self.author.refresh_from_db(fields=('followers_count',))
+        return self.author.followers_count
+
+    def test_subscribe_and_unsubscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.followers(), 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(self.followers(), 0)
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.followers(), 1)
+
+
+class FeedHeadCacheTest(RecipeTestCase):
+    """
+    Первая страница ленты берется из кеша, пока не изменились рецепты
+    авторов из подписок или сами подписки.
+    """
+
+    FEED_URL = f'{RECIPES_URL}feed/'
+
+    def head(self):
+        response = self.client.get(self.FEED_URL, {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.has_next = response.data['next'] is not None
+        return [recipe['id'] for recipe in response.data['results']]
+
+    @mock.patch('recipes.signals.schedule_thumbnails')
+    def publish(self, author, name, schedule_thumbnails):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                name=name, text='Описание', cooking_time=10,
+                author=author, image='recipes/test.png'
+            )
+
+    def test_followed_author_publishes(self):
+        head = self.head()
+        self.assertEqual(head, [recipe.pk for recipe in self.recipes[:-3:-1]])
+        Recipe.objects.bulk_create([Recipe(
+            name='Без сигналов', text='Описание', cooking_time=10,
+            author=self.author, image='recipes/test.png'
+        )])
+        self.assertEqual(self.head(), head)
+        recipe = self.publish(self.author, 'Новый рецепт')
+        self.assertEqual(self.head()[0], recipe.pk)
+
+    def test_other_author_publishes(self):
+        head = self.head()
+        other = User.objects.create_user(
+            username='other', email='other@example.com',
+            first_name='Иван', last_name='Другой', password='pass-12345'
+        )
+        self.publish(other, 'Чужой рецепт')
+        self.assertEqual(self.head(), head)
+
+    def test_unfollow(self):
+        self.assertTrue(self.head())
+        self.assertTrue(self.has_next)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                f'/api/users/{self.author.pk}/subscribe/'
+            )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.head(), [])
+        self.assertFalse(self.has_next)
+
+    def test_unfollow_through_orm(self):
+        self.assertTrue(self.head())
+        self.assertTrue(self.has_next)
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(user=self.user, author=self.author).delete()
+        self.assertEqual(self.head(), [])
+        self.assertFalse(self.has_next)
+
+
+class RecipeDocumentCacheTest(RecipeTestCase):
+    """
+    Документы рецептов общие для всех пользователей, а флаги каждого
+    пользователя подставляются поверх них при выдаче. Изменение
+    рецепта дает новый документ.
+    """
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('recipes.signals.schedule_thumbnails')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stranger = User.objects.create_user(
+            username='stranger', email='stranger@example.com',
+            first_name='Петр', last_name='Чужой', password='pass-12345'
+        )
+        self.detail_url = f'{RECIPES_URL}{self.recipes[0].pk}/'
+
+    def flags(self, client, url=RECIPES_URL):
+        response = client.get(url, {'limit': RECIPES_COUNT})
+        self.assertEqual(response.status_code, 200)
+        recipes = response.data.get('results', [response.data])
+        return {
+            recipe['id']: (recipe['is_favorited'],
+                           recipe['is_in_shopping_cart'],
+                           recipe['author']['is_subscribed'])
+            for recipe in recipes
+        }
+
+    def reader_flags(self):
+        flags = dict.fromkeys((recipe.pk for recipe in self.recipes),
+                              (False, False, True))
+        flags[self.recipes[0].pk] = (True, False, True)
+        flags[self.recipes[1].pk] = (False, True, True)
+        return flags
+
+    def test_other_users_do_not_see_cached_flags(self):
+        stranger = APIClient()
+        stranger.force_authenticate(self.stranger)
+        anonymous = APIClient()
+        for name, first in (('reader', self.client), ('stranger', stranger)):
+            with self.subTest(first=name):
+                cache.clear()
+                self.flags(first)
+                self.flags(first, self.detail_url)
+                with mock.patch.object(
+                    documents, 'build_documents',
+                    wraps=documents.build_documents
+                ) as build:
+                    reader = self.flags(self.client)
+                    reader_detail = self.flags(self.client, self.detail_url)
+                    other = self.flags(stranger)
+                    other_detail = self.flags(stranger, self.detail_url)
+                    guest = self.flags(anonymous)
+                build.assert_not_called()
+                self.assertEqual(reader, self.reader_flags())
+                self.assertEqual(reader_detail[self.recipes[0].pk],
+                                 (True, False, True))
+                self.assertEqual(set(other.values()), {(False, False, False)})
+                self.assertEqual(other_detail[self.recipes[0].pk],
+                                 (False, False, False))
+                self.assertEqual(set(guest.values()), {(False, False, None)})
+
+    def test_recipe_edit_refreshes_document(self):
+        recipe = self.recipes[0]
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['name'], recipe.name)
+
+        recipe.name = 'Новое название'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['name'], 'Новое название')
+        self.assertTrue(response.data['is_favorited'])
+
+        author = APIClient()
+        author.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = author.patch(self.detail_url, {
+                'name': recipe.name, 'text': 'Новое описание',
+                'cooking_time': 25, 'tags': [self.tags[1].pk],
+                'ingredients': [{'id': self.ingredients[4].pk,
+                                 'amount': 9}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        for client in (self.client, author):
+            response = client.get(self.detail_url)
+            self.assertEqual(
+                (response.data['text'], response.data['cooking_time']),
+                ('Новое описание', 25)
+            )
+            self.assertEqual([tag['id'] for tag in response.data['tags']],
+                             [self.tags[1].pk])
+            self.assertEqual(
+                [(item['id'], item['amount'])
+                 for item in response.data['ingredients']],
+                [(self.ingredients[4].pk, 9)]
+            )
+        response = self.client.get(RECIPES_URL, {'limit': RECIPES_COUNT})
+        listed = {item['id']: item for item in response.data['results']}
+        self.assertEqual(listed[recipe.pk]['text'], 'Новое описание')
+
+        ingredient = self.ingredients[4]
+        ingredient.name = 'Переименованный продукт'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['ingredients'][0]['name'],
+                         'Переименованный продукт')
+
+
+@override_settings(
+    MIDDLEWARE=['api.profiling.ProfilingMiddleware', *settings.MIDDLEWARE],
+    PROFILING_ENABLED=True,
+    PROFILING_SLOW_REQUEST_MS=60000
+)
+class ProfilingTest(RecipeTestCase):
+    """Замеры ProfilingMiddleware и их выдача в /api/profiling/."""
+
+    PROFILING_URL = '/api/profiling/'
+
+    def setUp(self):
+        super().setUp()
+        route_stats.clear()
+        self.addCleanup(route_stats.clear)
+        self.admin = APIClient()
+        self.admin.force_authenticate(User.objects.create_superuser(
+            username='admin', email='admin@example.com',
+            first_name='Админ', last_name='Админов', password='pass-12345'
+        ))
+
+    def test_only_admin_has_access(self):
+        for method in ('get', 'delete'):
+            with self.subTest(method=method):
+                response = getattr(self.client, method)(self.PROFILING_URL)
+                self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.admin.get(self.PROFILING_URL).status_code, 200)
+        self.assertEqual(self.admin.delete(self.PROFILING_URL).status_code,
+                         204)
+
+    def test_collected_fields(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(RECIPES_URL, {'limit': 2})
+        queries = len(context.captured_queries)
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{queries} queries"', timing)
+        self.assertEqual(
+            [part.split(';')[0] for part in timing.split(', ')],
+            ['db', 'view', 'render', 'total']
+        )
+        route = f'GET {response.resolver_match.view_name}'
+
+        summary = self.admin.get(self.PROFILING_URL).data
+        self.assertTrue(summary['enabled'])
+        self.assertEqual(summary['pid'], os.getpid())
+        self.assertEqual(set(summary['response_cache']), {'hits', 'misses'})
+        self.assertEqual(list(summary['routes']), [route])
+        stats = summary['routes'][route]
+        self.assertEqual(list(stats), ['count', *METRICS])
+        self.assertEqual(stats['count'], 1)
+        for metric in METRICS:
+            self.assertEqual(
+                list(stats[metric]),
+                [*(f'p{rank}' for rank in PERCENTILES), 'max']
+            )
+        self.assertEqual(stats['queries']['max'], queries)
+        self.assertEqual(stats['size']['max'], len(response.content))
+        self.assertGreaterEqual(stats['total']['max'], stats['view']['max'])
+
+        response = self.admin.delete(self.PROFILING_URL)
+        routes = self.admin.get(self.PROFILING_URL).data['routes']
+        self.assertEqual(list(routes),
+                         [f'DELETE {response.resolver_match.view_name}'])
+
+    @override_settings(PROFILING_SLOW_REQUEST_MS=0)
+    def test_slow_request_is_logged(self):
+        with self.assertLogs('api.profiling', 'WARNING') as logs:
+            response = self.client.get(RECIPES_URL, {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'GET {response.resolver_match.view_name}',
+                      logs.output[0])
@@ -4,6 +4,7 @@ from rest_framework.routers import DefaultRouter
 from api.views import (
     CustomUserViewSet,
     IngredientViewSet,
+    ProfilingView,
     RecipeViewSet,
     TagViewSet,
 )
@@ -20,5 +21,6 @@ router_v1.register(r'recipes', RecipeViewSet, basename='recipe')
 
 urlpatterns = [
     path('', include(router_v1.urls)),
+    path('profiling/', ProfilingView.as_view(), name='profiling'),
     path('auth/', include('djoser.urls.authtoken')),
 ]
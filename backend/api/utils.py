@@ -1,31 +1,266 @@
+import csv
+import hashlib
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection, transaction
+from django.db.models import F, Sum, Window
+from django.db.models.functions import RowNumber
 from django.shortcuts import get_object_or_404
 from rest_framework import status
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 
-from api.serializers import RecipeMinSerializer
-from recipes.models import Recipe
+from api.serializers import (
+    RECIPE_MIN_FIELDS,
+    RecipeIdsSerializer,
+    RecipeMinSerializer,
+)
+from recipes.cache import (
+    get_catalog_version,
+    get_recipes_versions,
+    invalidate_user_relations,
+)
+from recipes.counters import change_counter
+from recipes.models import IngredientInRecipe, Recipe
+from recipes.units import canonical_unit, merge_by_name, unit_factor
 
 
-def handle_action(request, pk, relation, error_message, serializer):
+@transaction.atomic
+def handle_action(request, pk, relation, error_message, serializer,
+                  counter=None):
     """
     Создает обработчик для пары действий POST и DELETE
-    на основе переданных параметров.
+    на основе переданных параметров. Связь добавляется одним запросом
+    INSERT ... ON CONFLICT DO NOTHING RETURNING и удаляется одним
+    DELETE ... RETURNING. Рецепт ищется для ответа 404 только тогда,
+    когда запрос не вернул строку. Если передан counter, поле рецепта
+    с этим именем меняется вместе со связью.
     """
 
+    try:
+        pk = Recipe._meta.pk.to_python(pk)
+    except DjangoValidationError:
+        raise NotFound()
     user = request.user
-    recipe = get_object_or_404(Recipe, pk=pk)
-    relation_set = getattr(recipe, relation)
+    through = getattr(Recipe, relation).through
+    recipes = Recipe.objects.filter(pk=pk)
 
-    if request.method == 'POST':
-        if relation_set.contains(user):
-            raise ValidationError(error_message)
-        relation_set.add(user)
-    elif request.method == 'DELETE':
-        if not relation_set.contains(user):
+    if request.method == 'DELETE':
+        if not delete_relations(through, user, [pk]):
+            get_object_or_404(recipes)
             raise ValidationError(error_message)
-        relation_set.remove(user)
+        if counter:
+            change_counter(recipes, counter, -1)
+        invalidate_user_relations(user.pk)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    serializer = RecipeMinSerializer(recipe)
+    if not insert_relations(through, user, [pk]):
+        get_object_or_404(recipes)
+        raise ValidationError(error_message)
+    if counter:
+        change_counter(recipes, counter, 1)
+    invalidate_user_relations(user.pk)
+
+    serializer = RecipeMinSerializer(recipes.only(*RECIPE_MIN_FIELDS).get())
     return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+def relation_columns(through):
+    quote = connection.ops.quote_name
+    return (quote(through._meta.db_table),
+            quote(through._meta.get_field('user').column),
+            quote(through._meta.get_field('recipe').column))
+
+
+def fetch_returned(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def insert_relations(through, user, pks):
+    """
+    Добавляет связи пользователя с существующими рецептами через
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING и возвращает
+    id рецептов только из реально добавленных строк. Несуществующие
+    рецепты отсекает SELECT, поэтому отложенная проверка внешнего
+    ключа не падает при фиксации транзакции.
+    """
+
+    if not pks:
+        return []
+    table, user_column, recipe_column = relation_columns(through)
+    quote = connection.ops.quote_name
+    recipes = quote(Recipe._meta.db_table)
+    recipe_pk = quote(Recipe._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(pks))
+    return fetch_returned(
+        f'INSERT INTO {table} ({user_column}, {recipe_column}) '
+        f'SELECT %s, {recipe_pk} FROM {recipes} '
+        f'WHERE {recipe_pk} IN ({placeholders}) '
+        f'ON CONFLICT DO NOTHING RETURNING {recipe_column}',
+        [user.pk, *pks]
+    )
+
+
+def delete_relations(through, user, pks):
+    """
+    Удаляет связи пользователя с рецептами и возвращает id рецептов
+    из RETURNING, то есть только реально удаленных строк.
+    """
+
+    if not pks:
+        return []
+    table, user_column, recipe_column = relation_columns(through)
+    placeholders = ', '.join(['%s'] * len(pks))
+    return fetch_returned(
+        f'DELETE FROM {table} WHERE {user_column} = %s '
+        f'AND {recipe_column} IN ({placeholders}) RETURNING {recipe_column}',
+        [user.pk, *pks]
+    )
+
+
+@transaction.atomic
+def handle_batch_action(request, relation, counter=None):
+    """
+    Добавляет или удаляет сразу несколько рецептов из связи
+    пользователя. Повторное добавление и удаление отсутствующих
+    рецептов ошибкой не считаются. Счетчик меняется только для строк,
+    которые вернул RETURNING, поэтому параллельные запросы не учитывают
+    одну и ту же строку дважды.
+    """
+
+    serializer = RecipeIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    recipes = list(dict.fromkeys(serializer.validated_data['recipes']))
+    pks = [recipe.pk for recipe in recipes]
+    user = request.user
+    through = getattr(Recipe, relation).through
+
+    if request.method == 'DELETE':
+        changed, delta = delete_relations(through, user, pks), -1
+    else:
+        changed, delta = insert_relations(through, user, pks), 1
+    if changed:
+        if counter:
+            change_counter(Recipe.objects.filter(pk__in=changed),
+                           counter, delta)
+        invalidate_user_relations(user.pk)
+
+    if request.method == 'DELETE':
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(RecipeMinSerializer(recipes, many=True).data,
+                    status=status.HTTP_201_CREATED)
+
+
+def attach_recipes_preview(authors, limit):
+    """
+    Загружает превью рецептов для страницы авторов одним запросом.
+    При положительном limit берет не более limit последних рецептов
+    каждого автора с помощью оконной функции ROW_NUMBER.
+    """
+
+    recipes = Recipe.objects.filter(author__in=authors).only(
+        *RECIPE_MIN_FIELDS, 'author_id', 'pub_date'
+    )
+    if limit > 0:
+        recipes = recipes.annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc())
+            )
+        ).filter(row_number__lte=limit)
+
+    previews = defaultdict(list)
+    for recipe in recipes:
+        previews[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recipes_preview = previews[author.id]
+    return authors
+
+
+def get_shopping_cart_ingredients(user):
+    """
+    Суммирует количество ингредиентов в рецептах из списка покупок
+    пользователя. Количество переводится в основные единицы прямо
+    в запросе, одинаковые продукты объединяются. Результат кешируется,
+    пока не изменится список покупок или один из его рецептов.
+    Для кеша и объединения продуктов список собирается целиком, поэтому
+    ответ отдается потоком уже из готового списка. Его размер ограничен
+    числом разных продуктов, а не числом рецептов в списке покупок.
+    """
+
+    recipe_ids = list(
+        Recipe.shoppingcart.through.objects.filter(user=user).order_by(
+            'recipe_id'
+        ).values_list('recipe_id', flat=True)
+    )
+    digest = hashlib.md5(
+        repr((recipe_ids, get_recipes_versions(recipe_ids),
+              get_catalog_version())).encode()
+    ).hexdigest()
+    cache_key = f'shopping_cart:{user.pk}:{digest}'
+    ingredients = cache.get(cache_key)
+    if ingredients is None:
+        unit_field = 'ingredient__measurement_unit'
+        ingredients = merge_by_name(
+            IngredientInRecipe.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values(
+                name=F('ingredient__name'),
+                measurement_unit=canonical_unit(unit_field),
+            ).annotate(
+                amount=Sum(F('amount') * unit_factor(unit_field))
+            ).order_by()
+        )
+        cache.set(cache_key, ingredients,
+                  settings.SHOPPING_CART_CACHE_TIMEOUT)
+    return ingredients
+
+
+class Echo:
+    """Псевдо-буфер для построчной записи CSV в потоковый ответ."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_cart_to_txt(ingredients):
+    for ingredient in ingredients:
+        yield (f'{ingredient["name"]}: {ingredient["amount"]}'
+               f'{ingredient["measurement_unit"]}\n')
+
+
+def shopping_cart_to_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for ingredient in ingredients:
+        yield writer.writerow((ingredient['name'],
+                               ingredient['measurement_unit'],
+                               ingredient['amount']))
+
+
+def shopping_cart_to_json(ingredients):
+    yield '['
+    separator = ''
+    for ingredient in ingredients:
+        yield separator + json.dumps(
+            {'name': ingredient['name'],
+             'measurement_unit': ingredient['measurement_unit'],
+             'amount': ingredient['amount']},
+            ensure_ascii=False
+        )
+        separator = ','
+    yield ']'
+
+
+SHOPPING_CART_FORMATS = {
+    'txt': (shopping_cart_to_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_cart_to_csv, 'text/csv; charset=utf-8'),
+    'json': (shopping_cart_to_json, 'application/json'),
+}
@@ -1,131 +1,271 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import hashlib
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Value
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.validators import ValidationError
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from api.filters import IngredientFilter
+from api.bulk import export_recipes, import_recipes
+from api.documents import RECIPE_PAGE_FIELDS
+from api.filters import RecipeFilter
+from api.mixins import (
+    AnonymousCacheMixin,
+    CatalogCacheMixin,
+    reset_response_cache_stats,
+)
+from api.pagination import (
+    CursorOrPageNumberPagination,
+    HeadCachedCursorPagination,
+    PageNumberLimitPagination,
+    UserCursorOrPageNumberPagination,
+)
 from api.permissions import IsAuthorOrReadOnly
+from api.profiling import profiling_summary, route_stats
+from api.relations import get_user_relations
 from api.serializers import (
+    RECIPE_MIN_FIELDS,
     IngredientSerializer,
+    RecipeDocumentSerializer,
+    RecipeMatchSerializer,
     RecipeMinSerializer,
-    RecipeReadSerializer,
     RecipeWriteSerializer,
     TagSerializer,
     UserFollowSerializer,
 )
-from api.utils import handle_action
+from api.utils import (
+    SHOPPING_CART_FORMATS,
+    attach_recipes_preview,
+    get_shopping_cart_ingredients,
+    handle_action,
+    handle_batch_action,
+)
+from recipes.cache import get_authors_feed_versions
+from recipes.ingredient_index import ingredient_index
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.pantry_index import pantry_index
 from users.models import Follow, User
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class ProfilingView(APIView):
+    """
+    Перцентили замеров запросов по маршрутам для текущего процесса
+    и общие для всех процессов попадания в кеш ответов.
+    DELETE сбрасывает накопленные замеры и счетчики кеша.
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(profiling_summary())
+
+    def delete(self, request):
+        route_stats.clear()
+        reset_response_cache_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class TagViewSet(CatalogCacheMixin, ReadOnlyModelViewSet):
     """ViewSet для работы с моделью Tag."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
+    catalog_name = 'tags'
 
+    def get_catalog_data(self):
+        return self.get_serializer(self.get_queryset(), many=True).data
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+
+class IngredientViewSet(CatalogCacheMixin, ReadOnlyModelViewSet):
     """ViewSet для работы с моделью Ingredient."""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
-    filter_backends = (DjangoFilterBackend, )
-    filterset_class = IngredientFilter
+    catalog_name = 'ingredients'
+
+    def get_catalog_data(self):
+        name = self.request.query_params.get('name')
+        if name:
+            return ingredient_index.search(name)
+        return ingredient_index.all()
 
 
 class CustomUserViewSet(UserViewSet):
     """ViewSet для работы с моделью User."""
 
     http_method_names = ['get', 'post', 'delete']
+    pagination_class = UserCursorOrPageNumberPagination
+
+    def get_recipes_limit(self):
+        return int(self.request.query_params.get('recipes_limit', 0))
 
     @action(detail=False, serializer_class=UserFollowSerializer)
     def subscriptions(self, request):
         followed_user = User.objects.filter(
             following__user=request.user
-        )
+        ).annotate(is_subscribed=Value(True))
+        limit = self.get_recipes_limit()
 
         page = self.paginate_queryset(followed_user)
         if page is not None:
+            attach_recipes_preview(page, limit)
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
+        followed_user = attach_recipes_preview(list(followed_user), limit)
         serializer = self.get_serializer(followed_user, many=True)
         return Response(serializer.data)
 
     @action(methods=['post'],
             detail=True,
             serializer_class=UserFollowSerializer)
+    @transaction.atomic
     def subscribe(self, request, id=None):
         user = request.user
         following = get_object_or_404(User, pk=id)
-        if Follow.objects.filter(author=following, user=user).exists():
-            raise ValidationError('Подписка уже сушествует')
         if user == following:
             raise ValidationError('Вы не можете подписаться на самого себя')
-        Follow.objects.create(author=following, user=request.user)
+        try:
+            with transaction.atomic():
+                Follow.objects.create(author=following, user=user)
+        except IntegrityError:
+            raise ValidationError('Подписка уже сушествует')
+        following.followers_count += 1
+        following.is_subscribed = True
+        attach_recipes_preview([following], self.get_recipes_limit())
         serializer = self.get_serializer(following)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
+    @transaction.atomic
     def delete_subscribe(self, request, id=None):
-        user = request.user
-        author = get_object_or_404(User, pk=id)
-        follow = Follow.objects.filter(author=author, user=user)
-        if not follow.exists():
+        authors = User.objects.filter(pk=id)
+        deleted, _ = Follow.objects.filter(author_id=id,
+                                           user=request.user).delete()
+        if not deleted:
+            get_object_or_404(authors)
             raise ValidationError('Подписка не существует')
-        follow.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(AnonymousCacheMixin, ModelViewSet):
     """ViewSet для работы с моделью Recipe."""
 
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.defer('search_vector')
     permission_classes = (IsAuthorOrReadOnly,)
+    pagination_class = CursorOrPageNumberPagination
     filter_backends = (DjangoFilterBackend, )
+    filterset_class = RecipeFilter
     http_method_names = ['get', 'post', 'patch', 'delete']
 
     def get_serializer_class(self):
         if self.request.method in ('POST', 'PATCH'):
             return RecipeWriteSerializer
-        return RecipeReadSerializer
+        return RecipeDocumentSerializer
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        query_params = self.request.query_params
+        if self.action in ('list', 'retrieve', 'feed'):
+            queryset = queryset.only(*RECIPE_PAGE_FIELDS)
+        return queryset
 
-        is_favorited = query_params.get('is_favorited')
-        if is_favorited == '1':
-            queryset = queryset.filter(favorite=self.request.user)
+    def get_head_page_cache_key(self):
+        """
+        Ключ первой страницы ленты. В него входят версии всех авторов,
+        на которых подписан пользователь, поэтому новый рецепт автора
+        или изменение подписок сразу дают другой ключ.
+        """
+        user = self.request.user
+        authors = sorted(get_user_relations(self.request).following)
+        params = sorted(
+            (key, sorted(values))
+            for key, values in self.request.query_params.lists()
+        )
+        digest = hashlib.md5(
+            repr((params, authors,
+                  get_authors_feed_versions(authors))).encode()
+        ).hexdigest()
+        return f'recipes:feed:{user.pk}:{digest}'
 
-        is_in_shopping_cart = query_params.get('is_in_shopping_cart')
-        if is_in_shopping_cart == '1':
-            queryset = queryset.filter(shoppingcart=self.request.user)
+    @action(detail=False,
+            permission_classes=(IsAuthenticated,),
+            pagination_class=HeadCachedCursorPagination)
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь."""
 
-        author = query_params.get('author')
-        if author is not None:
-            queryset = queryset.filter(author=author)
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            Exists(
+                Follow.objects.filter(user=request.user,
+                                      author=OuterRef('author'))
+            )
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
 
-        tags = query_params.getlist('tags')
-        if tags:
-            queryset = queryset.filter(tags__slug__in=tags).distinct()
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
 
-        return queryset
+    def get_pantry_params(self):
+        params = self.request.query_params
+        try:
+            ingredients = [int(pk) for pk in params.getlist('ingredients')]
+            max_missing = params.get('max_missing')
+            if max_missing is not None:
+                max_missing = int(max_missing)
+        except ValueError:
+            raise ValidationError(
+                'ingredients и max_missing должны быть числами'
+            )
+        if not ingredients:
+            raise ValidationError('Укажите хотя бы один ингредиент')
+        return ingredients, max_missing
+
+    @action(detail=False, pagination_class=PageNumberLimitPagination)
+    def cook(self, request):
+        """
+        Рецепты, которые можно приготовить из переданных ингредиентов,
+        по убыванию доли имеющихся ингредиентов.
+        """
+
+        matches = pantry_index.match(*self.get_pantry_params())
+        page = self.paginate_queryset(matches)
+        rows = matches[:] if page is None else page
+        recipes = Recipe.objects.only(*RECIPE_MIN_FIELDS).in_bulk(
+            [row[0] for row in rows]
+        )
+        result = []
+        for recipe_id, coverage, missing, missing_ingredients in rows:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.coverage = round(coverage, 3)
+            recipe.missing_count = missing
+            recipe.missing_ingredients = missing_ingredients
+            result.append(recipe)
+
+        serializer = RecipeMatchSerializer(
+            result, many=True, context=self.get_serializer_context()
+        )
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     @action(methods=['post', 'delete'],
             detail=True,
@@ -148,20 +288,80 @@ class RecipeViewSet(ModelViewSet):
             pk=pk,
             relation='favorite',
             error_message='Рецепт отсутствует в списке избранных',
-            serializer=self.serializer_class
+            serializer=self.serializer_class,
+            counter='favorites_count'
+        )
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='shopping_cart',
+            url_name='shopping-cart-batch',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_batch(self, request):
+        """Добавляет или удаляет несколько рецептов из списка покупок."""
+
+        return handle_batch_action(request, relation='shoppingcart')
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='favorite',
+            url_name='favorite-batch',
+            permission_classes=(IsAuthenticated,))
+    def favorite_batch(self, request):
+        """Добавляет или удаляет несколько рецептов из избранного."""
+
+        return handle_batch_action(request,
+                                   relation='favorite',
+                                   counter='favorites_count')
+
+    @action(methods=['post'],
+            detail=False,
+            url_path='import',
+            permission_classes=(IsAuthenticated,))
+    def import_recipes(self, request):
+        """Создает рецепты из тела запроса в формате NDJSON."""
+
+        created, errors = import_recipes(
+            (line.decode('utf-8') for line in request.stream or ()),
+            author=request.user,
+            request=request
+        )
+        return Response({'created': created, 'errors': errors},
+                        status=(status.HTTP_201_CREATED if created
+                                else status.HTTP_400_BAD_REQUEST))
+
+    @action(detail=False, url_path='export')
+    def export_recipes(self, request):
+        """
+        Отдает рецепты в формате NDJSON потоком. По умолчанию картинка
+        передается ссылкой, с images=inline - в виде data URL, и тогда
+        файл можно снова загрузить через импорт.
+        """
+
+        queryset = self.filter_queryset(self.get_queryset())
+        include_images = request.query_params.get('images') == 'inline'
+        response = StreamingHttpResponse(
+            export_recipes(queryset, include_images=include_images),
+            content_type='application/x-ndjson'
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename=recipes.ndjson'
         )
+        return response
 
     @action(detail=False, permission_classes=(IsAuthenticated,))
     def download_shopping_cart(self, request):
-        recipes_in_shopping_cart = Recipe.objects.filter(
-            shoppingcart=request.user).values('id')
-        recipe_ingredients = Ingredient.objects.filter(
-            recipe__id__in=recipes_in_shopping_cart
-        ).annotate(total_count=Sum('ingredientinrecipe__amount'))
-
-        response = HttpResponse(content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename=shopping_cart'
-        response.writelines(f'{ingredient.name}: {ingredient.total_count}'
-                            f'{ingredient.measurement_unit}\n'
-                            for ingredient in recipe_ingredients)
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_CART_FORMATS:
+            raise ValidationError(
+                'Доступные форматы: ' + ', '.join(SHOPPING_CART_FORMATS)
+            )
+        render, content_type = SHOPPING_CART_FORMATS[file_format]
+        ingredients = get_shopping_cart_ingredients(request.user)
+
+        response = StreamingHttpResponse(render(ingredients),
+                                         content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename=shopping_cart.{file_format}'
+        )
         return response
@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework.authtoken',
     'rest_framework',
     'djoser',
@@ -40,6 +41,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+PROFILING_ENABLED = (
+    os.getenv('PROFILING_ENABLED', 'False').lower() == 'true'
+)
+PROFILING_SLOW_REQUEST_MS = int(os.getenv('PROFILING_SLOW_REQUEST_MS', 500))
+PROFILING_SAMPLES = int(os.getenv('PROFILING_SAMPLES', 1000))
+
+if PROFILING_ENABLED:
+    MIDDLEWARE.insert(0, 'api.profiling.ProfilingMiddleware')
+
 ROOT_URLCONF = 'foodgram.urls'
 
 TEMPLATES = [
@@ -105,8 +115,64 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/media'
 
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE', 10 * 1024 ** 2))
+RECIPE_IMAGE_MAX_DIMENSION = int(os.getenv('RECIPE_IMAGE_MAX_DIMENSION', 6000))
+RECIPE_THUMBNAIL_WIDTHS = (320, 640, 1280)
+RECIPE_THUMBNAIL_FORMAT = os.getenv('RECIPE_THUMBNAIL_FORMAT', 'WEBP')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+RECIPE_POPULARITY_HALF_LIFE = int(
+    os.getenv('RECIPE_POPULARITY_HALF_LIFE', 72)
+)
+
 DATA_DIR = '/data_backend'
 
+# Версии для сброса кешей, индексы ингредиентов и состава рецептов
+# и документы рецептов согласуются через общий кеш, поэтому в работе
+# нужен Redis (см. infra/.env.example). LocMemCache у каждого процесса
+# свой: изменения из manage.py и других воркеров он не видит, и
+# подходит только для тестов и локальной отладки в одном процессе.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND',
+                          'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', 300)),
+    }
+}
+
+# На каждый рецепт приходится ключ версии и документ, на пользователя -
+# версия и множества связей, поэтому лимит считается от числа рецептов
+# и активных пользователей с запасом. Redis вместо лимита записей
+# вытесняет ключи по maxmemory.
+if not CACHE_BACKEND.endswith('RedisCache'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 300000)),
+    }
+
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', 60))
+
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', 60))
+
+RECIPE_DOCUMENT_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_DOCUMENT_CACHE_TIMEOUT', 24 * 3600)
+)
+
+USER_RELATIONS_CACHE_TIMEOUT = int(
+    os.getenv('USER_RELATIONS_CACHE_TIMEOUT', 3600)
+)
+
+FEED_CACHE_TIMEOUT = int(os.getenv('FEED_CACHE_TIMEOUT', 300))
+
+SHOPPING_CART_CACHE_TIMEOUT = int(
+    os.getenv('SHOPPING_CART_CACHE_TIMEOUT', 3600)
+)
+
+PANTRY_INDEX_BACKGROUND_REBUILD = (
+    os.getenv('PANTRY_INDEX_BACKGROUND_REBUILD', 'True').lower() == 'true'
+)
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
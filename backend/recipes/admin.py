@@ -28,9 +28,10 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'author', 'tags')
     inlines = (IngredientInRecipeInline,)
 
-    @admin.display(description='Добавления в избранные')
+    @admin.display(description='Добавления в избранные',
+                   ordering='favorites_count')
     def count_favorite(self, instance):
-        return instance.favorite.count()
+        return instance.favorites_count
 
 
 @admin.register(Recipe.shoppingcart.through)
@@ -0,0 +1,138 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'catalog:version'
+RECIPES_VERSION_KEY = 'recipes:version'
+RECIPE_VERSION_KEY = 'recipes:{}:version'
+AUTHOR_FEED_VERSION_KEY = 'authors:{}:feed:version'
+RECIPE_INGREDIENTS_VERSION_KEY = 'recipes:ingredients:version'
+USER_RELATIONS_VERSION_KEY = 'users:{}:relations:version'
+
+
+def get_version(key):
+    """
+    Возвращает счетчик версии из кеша. Если ключа нет, счетчик
+    начинается с текущего времени, чтобы не повторять старые версии.
+    """
+
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(keys):
+    """Возвращает версии для списка ключей одним запросом к кешу."""
+
+    versions = cache.get_many(keys)
+    return [versions[key] if key in versions else get_version(key)
+            for key in keys]
+
+
+def bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    return bump_version(CATALOG_VERSION_KEY)
+
+
+def invalidate_catalog():
+    """Меняет версию справочников после фиксации транзакции."""
+
+    transaction.on_commit(bump_catalog_version)
+
+
+def get_recipes_version(pk=None):
+    """
+    Возвращает версию списка рецептов или, если передан pk,
+    версию отдельного рецепта.
+    """
+
+    if pk is None:
+        return get_version(RECIPES_VERSION_KEY)
+    return get_version(RECIPE_VERSION_KEY.format(pk))
+
+
+def get_recipes_versions(pks):
+    return get_versions([RECIPE_VERSION_KEY.format(pk) for pk in pks])
+
+
+def invalidate_recipes(*pks):
+    """
+    После фиксации транзакции меняет версию списка рецептов
+    и версии переданных рецептов.
+    """
+
+    def bump():
+        bump_version(RECIPES_VERSION_KEY)
+        for pk in pks:
+            bump_version(RECIPE_VERSION_KEY.format(pk))
+
+    transaction.on_commit(bump)
+
+
+def get_authors_feed_versions(pks):
+    """
+    Возвращает версии набора рецептов авторов одним запросом к кешу.
+    Версия автора меняется, когда у него появляется или удаляется рецепт.
+    """
+
+    return get_versions([AUTHOR_FEED_VERSION_KEY.format(pk) for pk in pks])
+
+
+def invalidate_authors_feed(*pks):
+    def bump():
+        for pk in pks:
+            bump_version(AUTHOR_FEED_VERSION_KEY.format(pk))
+
+    transaction.on_commit(bump)
+
+
+def get_recipe_ingredients_version():
+    return get_version(RECIPE_INGREDIENTS_VERSION_KEY)
+
+
+def invalidate_recipe_ingredients():
+    """Меняет версию состава рецептов после фиксации транзакции."""
+
+    transaction.on_commit(
+        lambda: bump_version(RECIPE_INGREDIENTS_VERSION_KEY)
+    )
+
+
+def get_user_relations_version(pk):
+    return get_version(USER_RELATIONS_VERSION_KEY.format(pk))
+
+
+def invalidate_user_relations(*pks):
+    """
+    После фиксации транзакции меняет версию избранного, списка покупок
+    и подписок пользователей.
+    """
+
+    def bump():
+        for pk in pks:
+            bump_version(USER_RELATIONS_VERSION_KEY.format(pk))
+
+    transaction.on_commit(bump)
+
+
+def incr_counter(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return None
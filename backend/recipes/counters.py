@@ -0,0 +1,51 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Recipe
+from users.models import Follow, User
+
+
+def change_counter(queryset, field, delta):
+    """
+    Атомарно меняет счетчик в базе выражением F(). Значение не опускается
+    ниже нуля, даже если счетчик разошелся с данными до пересчета.
+    """
+
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    return queryset.update(**{field: value})
+
+
+def count_related(queryset, field):
+    """
+    Подзапрос с числом строк queryset, у которых field указывает
+    на внешнюю запись. Если строк нет, возвращает 0.
+    """
+
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('*')).values('total')
+        ),
+        0
+    )
+
+
+def recount_users():
+    return User.objects.update(
+        recipes_count=count_related(Recipe.objects.all(), 'author'),
+        followers_count=count_related(Follow.objects.all(), 'author'),
+    )
+
+
+def recount_recipes(recipes=None):
+    """Пересчитывает favorites_count рецептов queryset, по умолчанию всех."""
+
+    if recipes is None:
+        recipes = Recipe.objects.all()
+    return recipes.update(
+        favorites_count=count_related(Recipe.favorite.through.objects.all(),
+                                      'recipe')
+    )
@@ -0,0 +1,80 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image
+
+from recipes.cache import invalidate_recipes
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_DIR = 'recipes/thumbs/'
+
+executor = (ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS,
+                               thread_name_prefix='thumbnails')
+            if settings.IMAGE_WORKERS else None)
+
+
+def make_thumbnails(source):
+    """
+    Создает уменьшенные копии картинки для всех ширин из настроек.
+    Имена файлов строятся по хешу содержимого, поэтому одинаковые
+    картинки обрабатываются один раз.
+    """
+
+    data = source.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    image_format = settings.RECIPE_THUMBNAIL_FORMAT
+    extension = image_format.lower()
+    thumbnails = {}
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        for width in settings.RECIPE_THUMBNAIL_WIDTHS:
+            name = f'{THUMBNAILS_DIR}{digest}_{width}.{extension}'
+            if not default_storage.exists(name):
+                thumbnail = image.copy()
+                thumbnail.thumbnail((width, width * 4))
+                buffer = io.BytesIO()
+                thumbnail.save(buffer, image_format, quality=80)
+                name = default_storage.save(name,
+                                            ContentFile(buffer.getvalue()))
+            thumbnails[str(width)] = name
+    return thumbnails
+
+
+def process_recipe_image(pk):
+    try:
+        recipe = Recipe.objects.only('image').get(pk=pk)
+        with recipe.image.open('rb') as source:
+            thumbnails = make_thumbnails(source)
+        thumbnails['source'] = recipe.image.name
+        Recipe.objects.filter(pk=pk, image=recipe.image.name).update(
+            thumbnails=thumbnails
+        )
+        invalidate_recipes(pk)
+    except Exception:
+        logger.exception('Не удалось обработать картинку рецепта %s', pk)
+
+
+def process_in_worker(pk):
+    try:
+        process_recipe_image(pk)
+    finally:
+        connection.close()
+
+
+def schedule_thumbnails(pk):
+    """Ставит обработку картинки рецепта в пул фоновых потоков."""
+
+    if executor is None:
+        process_recipe_image(pk)
+    else:
+        executor.submit(process_in_worker, pk)
@@ -0,0 +1,76 @@
+import threading
+from bisect import bisect_left
+
+from recipes.cache import get_catalog_version
+from recipes.models import Ingredient
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+
+def normalize(value):
+    """Приводит строку к виду для поиска без учета регистра и буквы ё."""
+
+    return value.casefold().replace('ё', 'е').strip()
+
+
+class IngredientIndex:
+    """
+    Отсортированный индекс ингредиентов в памяти процесса
+    для поиска по началу названия. Перестраивается при смене
+    версии каталога.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+
+    def _build(self, version):
+        rows = sorted(
+            (normalize(name), name, pk, measurement_unit)
+            for pk, name, measurement_unit
+            in Ingredient.objects.values_list('id', 'name', 'measurement_unit')
+        )
+        keys = [row[0] for row in rows]
+        entries = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, name, pk, measurement_unit in rows
+        ]
+        return version, keys, entries
+
+    def _load(self):
+        version = get_catalog_version()
+        index = self._index
+        if index is None or index[0] != version:
+            with self._lock:
+                if self._index is None or self._index[0] != version:
+                    self._index = self._build(version)
+                index = self._index
+        return index[1:]
+
+    def all(self):
+        return self._load()[1]
+
+    def search(self, query, limit=INGREDIENT_SEARCH_LIMIT):
+        """
+        Возвращает ингредиенты, название которых начинается с query,
+        а затем содержащие query, не более limit штук.
+        """
+
+        keys, entries = self._load()
+        query = normalize(query)
+        start = bisect_left(keys, query)
+        end = start
+        while (end < len(keys) and end - start < limit
+               and keys[end].startswith(query)):
+            end += 1
+        result = entries[start:end]
+        if len(result) < limit:
+            for key, entry in zip(keys, entries):
+                if query in key and not key.startswith(query):
+                    result.append(entry)
+                    if len(result) == limit:
+                        break
+        return result
+
+
+ingredient_index = IngredientIndex()
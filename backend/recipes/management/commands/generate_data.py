@@ -0,0 +1,256 @@
+import io
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from recipes.cache import (
+    invalidate_authors_feed,
+    invalidate_recipe_ingredients,
+    invalidate_recipes,
+)
+from recipes.counters import recount_recipes, recount_users
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from recipes.popularity import update_popularity
+from recipes.search import update_search_vectors
+from recipes.utils import batches
+from users.models import Follow, User
+
+ZIPF_EXPONENT = 1.1
+SYNTHETIC_IMAGE = 'recipes/synthetic.png'
+SYNTHETIC_PASSWORD = 'synthetic-password'
+DISHES = ('Суп', 'Салат', 'Пирог', 'Рагу', 'Каша', 'Запеканка', 'Омлет',
+          'Паста', 'Плов', 'Котлеты')
+SYNTHETIC_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def zipf_weights(size):
+    """
+    Накопленные веса распределения Ципфа: первые элементы выбираются
+    намного чаще последних, как популярные ингредиенты или авторы.
+    """
+
+    return list(accumulate(1 / (rank + 1) ** ZIPF_EXPONENT
+                           for rank in range(size)))
+
+
+def sample_distinct(rng, population, cum_weights, count):
+    """Выбирает count разных элементов с учетом весов."""
+
+    count = min(count, len(population))
+    result = set()
+    while len(result) < count:
+        result.update(rng.choices(population, cum_weights=cum_weights,
+                                  k=count - len(result)))
+    return result
+
+
+def around(rng, mean):
+    """Случайное целое от 0 до 2 * mean со средним mean."""
+
+    return rng.randint(0, 2 * mean) if mean > 0 else 0
+
+
+def insert(model, rows, batch_size):
+    """Добавляет строки пачками, пропуская уже существующие."""
+
+    total = 0
+    for batch in batches(rows, batch_size):
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+    return total
+
+
+class Command(BaseCommand):
+    help = ('Создает синтетических пользователей, рецепты, подписки, '
+            'избранное и списки покупок для нагрузочных замеров. '
+            'При одинаковом --seed данные совпадают')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients', type=int, default=6,
+                            help='Среднее число ингредиентов в рецепте')
+        parser.add_argument('--tags', type=int, default=2,
+                            help='Наибольшее число тегов у рецепта')
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Среднее число подписок пользователя')
+        parser.add_argument('--favorites', type=int, default=30,
+                            help='Средний размер избранного')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Средний размер списка покупок')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней раскидать даты рецептов')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synthetic')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def get_image(self):
+        if not default_storage.exists(SYNTHETIC_IMAGE):
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 64), '#E26C2D').save(buffer, 'PNG')
+            default_storage.save(SYNTHETIC_IMAGE,
+                                 ContentFile(buffer.getvalue()))
+        return SYNTHETIC_IMAGE
+
+    def get_tags(self):
+        tags = list(Tag.objects.values_list('pk', flat=True))
+        if not tags:
+            tags = [Tag.objects.create(name=name, color=color, slug=slug).pk
+                    for name, color, slug in SYNTHETIC_TAGS]
+        return tags
+
+    def create_users(self, rng, options):
+        prefix = options['prefix']
+        start = User.objects.filter(username__startswith=prefix).count()
+        password = make_password(SYNTHETIC_PASSWORD)
+        users = User.objects.bulk_create(
+            (User(username=f'{prefix}{number}',
+                  email=f'{prefix}{number}@example.com',
+                  first_name=rng.choice(('Анна', 'Иван', 'Мария', 'Олег')),
+                  last_name=f'Тестовый{number}',
+                  password=password)
+             for number in range(start, start + options['users'])),
+            batch_size=options['batch_size']
+        )
+        return [user.pk for user in users]
+
+    def create_recipes(self, rng, authors, ingredients, options):
+        """Создает рецепты с составом и тегами, возвращает их id."""
+
+        names = dict(Ingredient.objects.filter(
+            pk__in=ingredients
+        ).values_list('pk', 'name'))
+        tags = self.get_tags()
+        image = self.get_image()
+        author_weights = zipf_weights(len(authors))
+        ingredient_weights = zipf_weights(len(ingredients))
+        now = timezone.now()
+
+        recipes, compositions = [], []
+        for _ in range(options['recipes']):
+            composition = sample_distinct(
+                rng, ingredients, ingredient_weights,
+                max(1, around(rng, options['ingredients']))
+            )
+            main = names[next(iter(composition))]
+            recipes.append(Recipe(
+                name=f'{rng.choice(DISHES)}: {main}'[:200],
+                text='Понадобится: ' + ', '.join(
+                    names[pk] for pk in composition
+                ) + '.',
+                author_id=rng.choices(authors,
+                                      cum_weights=author_weights)[0],
+                image=image,
+                cooking_time=rng.randint(5, 180),
+            ))
+            compositions.append(composition)
+        Recipe.objects.bulk_create(recipes, batch_size=options['batch_size'])
+
+        for recipe in recipes:
+            recipe.pub_date = now - timedelta(
+                seconds=rng.randint(0, options['days'] * 24 * 3600)
+            )
+        Recipe.objects.bulk_update(recipes, ['pub_date'],
+                                   batch_size=options['batch_size'])
+
+        insert(IngredientInRecipe, (
+            IngredientInRecipe(recipe_id=recipe.pk, ingredient_id=pk,
+                               amount=rng.randint(1, 500))
+            for recipe, composition in zip(recipes, compositions)
+            for pk in composition
+        ), options['batch_size'])
+        max_tags = min(max(options['tags'], 1), len(tags))
+        insert(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=pk)
+            for recipe in recipes
+            for pk in rng.sample(tags, rng.randint(1, max_tags))
+        ), options['batch_size'])
+        return [recipe.pk for recipe in recipes]
+
+    def create_relations(self, rng, users, authors, recipes, options):
+        """Подписки, избранное и списки покупок пользователей."""
+
+        author_weights = zipf_weights(len(authors))
+        popular = list(recipes)
+        rng.shuffle(popular)
+        recipe_weights = zipf_weights(len(popular))
+
+        def user_recipes(relation, mean):
+            return (
+                relation.through(user_id=user, recipe_id=recipe)
+                for user in users
+                for recipe in sample_distinct(rng, popular, recipe_weights,
+                                              around(rng, mean))
+            )
+
+        follows = insert(Follow, (
+            Follow(user_id=user, author_id=author)
+            for user in users
+            for author in sample_distinct(rng, authors, author_weights,
+                                          around(rng, options['follows']))
+            if author != user
+        ), options['batch_size'])
+        favorites = insert(
+            Recipe.favorite.through,
+            user_recipes(Recipe.favorite, options['favorites']),
+            options['batch_size']
+        )
+        carts = insert(
+            Recipe.shoppingcart.through,
+            user_recipes(Recipe.shoppingcart, options['carts']),
+            options['batch_size']
+        )
+        return follows, favorites, carts
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        if not ingredients:
+            raise CommandError('Справочник ингредиентов пуст, '
+                               'сначала выполните load_csv')
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь')
+        rng = random.Random(options['seed'])
+        rng.shuffle(ingredients)
+        start = time.perf_counter()
+
+        users = self.create_users(rng, options)
+        authors = users[:]
+        rng.shuffle(authors)
+        recipes = self.create_recipes(rng, authors, ingredients, options)
+        follows, favorites, carts = self.create_relations(
+            rng, users, authors, recipes, options
+        )
+
+        recount_users()
+        recount_recipes()
+        update_popularity()
+        for position in range(0, len(recipes), options['batch_size']):
+            update_search_vectors(
+                *recipes[position:position + options['batch_size']]
+            )
+        invalidate_recipes()
+        invalidate_recipe_ingredients()
+        invalidate_authors_feed(*authors)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Создано за {elapsed:.1f} с: пользователей {len(users)}, '
+                f'рецептов {len(recipes)}, подписок {follows}, '
+                f'в избранном {favorites}, в списках покупок {carts}'
+            )
+        )
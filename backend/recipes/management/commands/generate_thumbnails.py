@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные картинки для рецептов, у которых их нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all',
+                            action='store_true',
+                            help='Пересоздать картинки для всех рецептов')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if not options['all']:
+            recipes = recipes.filter(thumbnails={})
+        count = 0
+        for pk in recipes.values_list('pk', flat=True).iterator():
+            process_recipe_image(pk)
+            count += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Обработано рецептов: {count}')
+        )
@@ -1,27 +1,149 @@
 import csv
+import io
+import json
+import time
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
 from foodgram import settings
-from recipes.models import Ingredient
+from recipes.cache import invalidate_catalog
+from recipes.models import Ingredient, Tag
+from recipes.utils import batches
 
 DATA_DIR = Path(settings.DATA_DIR)
 
+MODELS = {
+    'ingredient': (Ingredient, ('name', 'measurement_unit')),
+    'tag': (Tag, ('name', 'color', 'slug')),
+}
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(data_file):
+    yield from csv.DictReader(data_file)
+
+
+def read_json(data_file):
+    '''По одному читает объекты JSON-массива, не загружая файл целиком'''
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while not buffer:
+        chunk = data_file.read(JSON_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer = chunk.lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив объектов')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            row, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = data_file.read(JSON_CHUNK_SIZE)
+            if not chunk:
+                raise CommandError('Некорректный JSON-файл')
+            buffer += chunk
+            continue
+        yield row
+        buffer = buffer[end:]
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
 
 class Command(BaseCommand):
+    help = ('Загружает справочники из CSV или JSON пачками. '
+            'Повторный запуск не создает дубликатов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', default=['ingredients.csv'])
+        parser.add_argument('--model', choices=MODELS, default='ingredient')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загрузить через COPY во временную таблицу (PostgreSQL)'
+        )
+
+    def insert_batch(self, model, fields, batch):
+        model.objects.bulk_create(
+            (model(**{field: row[field] for field in fields})
+             for row in batch),
+            ignore_conflicts=True
+        )
+
+    def copy_batch(self, model, fields, batch):
+        '''
+        Загружает пачку через COPY и INSERT ... ON CONFLICT DO NOTHING.
+        Временная таблица удаляется явно, потому что внутри внешней
+        транзакции atomic() создает лишь точку сохранения и ON COMMIT DROP
+        не срабатывает до ее конца.
+        '''
+
+        table = model._meta.db_table
+        columns = ', '.join(fields)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([row[field] for field in fields] for row in batch)
+        buffer.seek(0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE staging ON COMMIT DROP AS '
+                f'SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            cursor.copy_expert(
+                f'COPY staging ({columns}) FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT DISTINCT {columns} FROM staging '
+                f'ON CONFLICT DO NOTHING'
+            )
+            cursor.execute('DROP TABLE staging')
+
+    def load_file(self, data_file_name, model, fields, options):
+        '''Читает файл пачками и добавляет данные в модель'''
+
+        data_file_path = DATA_DIR / data_file_name
+        reader = READERS.get(data_file_path.suffix)
+        if reader is None:
+            raise CommandError(f'Неизвестный формат файла {data_file_name}')
+        save_batch = self.copy_batch if options['copy'] else self.insert_batch
+
+        total = 0
+        before = model.objects.count()
+        start = time.perf_counter()
+        with open(data_file_path, 'r', encoding='utf-8') as data_file:
+            for batch in batches(reader(data_file), options['batch_size']):
+                save_batch(model, fields, batch)
+                total += len(batch)
+        elapsed = time.perf_counter() - start
+        created = model.objects.count() - before
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Данные успешно загружены из файла '
+                f'{data_file_name} в модель {model.__name__}: '
+                f'прочитано {total}, добавлено {created}, '
+                f'{total / elapsed if elapsed else total:.0f} строк/с'
+            )
+        )
+
     def handle(self, *args, **options):
-        def csv_to_model(csv_file, model):
-            '''Читайет файлы CSV и добавляет данные в модель'''
-
-            csv_file_path = DATA_DIR / csv_file
-            with open(csv_file_path, 'r', encoding='utf-8') as data_csv_file:
-                reader = csv.DictReader(data_csv_file)
-                model.objects.bulk_create(model(**row) for row in reader)
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        'Данные успешно загружены из файла '
-                        f'{csv_file} в модель {model.__name__}'
-                    )
-                )
-        csv_to_model('ingredients.csv', Ingredient)
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy доступен только для PostgreSQL')
+        model, fields = MODELS[options['model']]
+        for data_file_name in options['files']:
+            self.load_file(data_file_name, model, fields, options)
+        invalidate_catalog()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from recipes.counters import count_related, recount_recipes, recount_users
+from recipes.models import Recipe
+from users.models import Follow, User
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики рецептов, подписчиков и избранного '
+            'по фактическим данным')
+
+    def count_drift(self):
+        users = User.objects.alias(
+            actual_recipes=count_related(Recipe.objects.all(), 'author'),
+            actual_followers=count_related(Follow.objects.all(), 'author'),
+        ).filter(
+            ~Q(recipes_count=F('actual_recipes'))
+            | ~Q(followers_count=F('actual_followers'))
+        ).count()
+        recipes = Recipe.objects.alias(
+            actual_favorites=count_related(
+                Recipe.favorite.through.objects.all(), 'recipe'
+            )
+        ).exclude(favorites_count=F('actual_favorites')).count()
+        return users, recipes
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        users_drift, recipes_drift = self.count_drift()
+        users = recount_users()
+        recipes = recount_recipes()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Пересчитано пользователей: {users} '
+                f'(исправлено {users_drift}), '
+                f'рецептов: {recipes} (исправлено {recipes_drift})'
+            )
+        )
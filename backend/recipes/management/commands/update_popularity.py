@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.cache import invalidate_recipes
+from recipes.popularity import update_popularity
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает популярность рецептов для сортировки '
+            'ordering=popular. Запускается периодически, например из cron')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = update_popularity()
+        invalidate_recipes()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Популярность пересчитана для {count} рецептов '
+                f'за {elapsed:.2f} с'
+            )
+        )
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:13
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_alter_recipe_author_alter_recipe_ingredients'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='amount',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, 'Количество ингредиента не может быть меньше 1'), django.core.validators.MaxValueValidator(10000, 'Время должно быть не больше 1000')], verbose_name='Количество'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, 'Время должно быть не меньше 1 минуты'), django.core.validators.MaxValueValidator(1440, 'Время должно быть не больше 1440 минут (сутки)')], verbose_name='Время приготовления'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='recipes', to='recipes.tag', verbose_name='Теги'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'),
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX recipe_favorite_user_recipe_idx '
+                'ON recipe_favorite (user_id, recipe_id);',
+            reverse_sql='DROP INDEX recipe_favorite_user_recipe_idx;',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX recipe_shoppingcart_user_recipe_idx '
+                'ON recipe_shoppingcart (user_id, recipe_id);',
+            reverse_sql='DROP INDEX recipe_shoppingcart_user_recipe_idx;',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX recipes_recipe_tags_tag_recipe_idx '
+                'ON recipes_recipe_tags (tag_id, recipe_id);',
+            reverse_sql='DROP INDEX recipes_recipe_tags_tag_recipe_idx;',
+        ),
+    ]
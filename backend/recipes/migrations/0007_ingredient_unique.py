@@ -0,0 +1,53 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:13
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """
+    Оставляет по одному ингредиенту на пару (name, measurement_unit),
+    переносит на него строки рецептов с дубликатов.
+    """
+
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep_id=Min('id'), total=Count('id')
+    ).filter(total__gt=1)
+
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        other_ids = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=keep_id).values_list('id', flat=True)
+        for other_id in list(other_ids):
+            IngredientInRecipe.objects.filter(
+                ingredient_id=other_id,
+                recipe_id__in=IngredientInRecipe.objects.filter(
+                    ingredient_id=keep_id
+                ).values('recipe_id')
+            ).delete()
+            IngredientInRecipe.objects.filter(
+                ingredient_id=other_id
+            ).update(ingredient_id=keep_id)
+            Ingredient.objects.filter(id=other_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (
     MaxValueValidator,
     MinValueValidator,
@@ -33,6 +34,12 @@ class Ingredient(models.Model):
         ordering = ('name',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -85,6 +92,10 @@ class Recipe(models.Model):
                                          related_name='recipe')
     image = models.ImageField(upload_to='recipes/',
                               verbose_name='Картинка')
+    thumbnails = models.JSONField(default=dict,
+                                  blank=True,
+                                  editable=False,
+                                  verbose_name='Уменьшенные картинки')
     text = models.TextField(verbose_name='Описание')
     pub_date = models.DateTimeField(auto_now_add=True,
                                     verbose_name='Дата публикации')
@@ -105,6 +116,17 @@ class Recipe(models.Model):
         related_name='favorited',
         db_table='recipe_favorite',
         blank=True)
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное'
+    )
+    popularity = models.FloatField(default=0,
+                                   editable=False,
+                                   verbose_name='Популярность')
+    search_vector = SearchVectorField(null=True,
+                                      editable=False,
+                                      verbose_name='Поисковый вектор')
 
     shoppingcart = models.ManyToManyField(
         User,
@@ -117,6 +139,14 @@ class Recipe(models.Model):
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipe_author_pub_date_id_idx'),
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=('-popularity', '-id'),
+                         name='recipe_popularity_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
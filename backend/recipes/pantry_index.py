@@ -0,0 +1,241 @@
+import logging
+import threading
+from array import array
+
+from django.conf import settings
+from django.db import connection
+
+from recipes.cache import get_recipe_ingredients_version
+from recipes.models import IngredientInRecipe
+
+logger = logging.getLogger(__name__)
+
+BUILD_CHUNK_SIZE = 10000
+DENSE_RATIO = 32
+
+
+def popcount(value):
+    return bin(value).count('1')
+
+
+def to_bitset(positions, size):
+    """Собирает битовое множество из номеров позиций."""
+
+    data = bytearray(size // 8 + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+def add_to_counter(planes, bitset):
+    """
+    Прибавляет единицу к счетчикам всех позиций из bitset.
+    Счетчики хранятся по разрядам: planes[j] - j-й бит каждого счетчика.
+    """
+
+    for j, plane in enumerate(planes):
+        planes[j] = plane ^ bitset
+        bitset &= plane
+        if not bitset:
+            return
+    planes.append(bitset)
+
+
+def split_by_counter(planes, candidates):
+    """
+    Разбивает позиции candidates на битовые множества по значению
+    счетчика, записанного по разрядам в planes.
+    """
+
+    result = {}
+    for value in range(1, 1 << len(planes)):
+        bitset = candidates
+        for j, plane in enumerate(planes):
+            bitset &= plane if value >> j & 1 else candidates ^ plane
+        if bitset:
+            result[value] = bitset
+    return result
+
+
+class PantryMatches:
+    """
+    Ленивый результат подбора. Рецепты разбиты на группы с одинаковыми
+    долей имеющихся и числом недостающих ингредиентов. Группы идут по
+    убыванию доли имеющихся и возрастанию числа недостающих,
+    внутри группы - от новых рецептов к старым. При срезе позиции
+    достаются только для нужной страницы.
+    """
+
+    def __init__(self, index, groups, available):
+        self.index = index
+        self.groups = groups
+        self.available = available
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(popcount(bitset) for *_, bitset in self.groups)
+        return self._count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError('Поддерживаются только срезы с шагом 1')
+        start = key.start or 0
+        stop = len(self) if key.stop is None else key.stop
+        limit = stop - start
+        result = []
+        for coverage, missing, bitset in self.groups:
+            if len(result) >= limit:
+                break
+            if start:
+                size = popcount(bitset)
+                if start >= size:
+                    start -= size
+                    continue
+            while bitset and len(result) < limit:
+                position = bitset.bit_length() - 1
+                bitset ^= 1 << position
+                if start:
+                    start -= 1
+                    continue
+                result.append(self.row(position, coverage, missing))
+        return result
+
+    def row(self, position, coverage, missing):
+        recipe_ids, offsets, ingredients = self.index
+        missing_ingredients = [
+            pk for pk in ingredients[offsets[position]:offsets[position + 1]]
+            if pk not in self.available
+        ]
+        return recipe_ids[position], coverage, missing, missing_ingredients
+
+
+class PantryIndex:
+    """
+    Индекс состава рецептов в памяти процесса для подбора рецептов
+    по имеющимся ингредиентам. Рецепты пронумерованы по возрастанию id.
+    Для каждого ингредиента хранится множество номеров его рецептов:
+    у частых - битовое множество, у редких - компактный массив.
+    Состав рецептов лежит в общем массиве со смещениями.
+    При смене версии состава рецептов индекс перестраивается в фоновом
+    потоке, а запросы до конца перестройки обслуживает прежний индекс.
+    Синхронно индекс строится только при первом обращении или при
+    выключенном PANTRY_INDEX_BACKGROUND_REBUILD.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._rebuilding = False
+
+    def _build(self, version):
+        rows = IngredientInRecipe.objects.order_by(
+            'recipe_id', 'ingredient_id'
+        ).values_list('recipe_id', 'ingredient_id').iterator(
+            chunk_size=BUILD_CHUNK_SIZE
+        )
+        recipe_ids, offsets, ingredients = array('Q'), array('I'), array('Q')
+        postings = {}
+        for recipe_id, ingredient_id in rows:
+            if not recipe_ids or recipe_ids[-1] != recipe_id:
+                recipe_ids.append(recipe_id)
+                offsets.append(len(ingredients))
+            ingredients.append(ingredient_id)
+            if ingredient_id not in postings:
+                postings[ingredient_id] = array('I')
+            postings[ingredient_id].append(len(recipe_ids) - 1)
+        offsets.append(len(ingredients))
+
+        count = len(recipe_ids)
+        for ingredient_id, positions in postings.items():
+            if len(positions) * DENSE_RATIO >= count:
+                postings[ingredient_id] = to_bitset(positions, count)
+
+        by_size = {}
+        for position in range(count):
+            size = offsets[position + 1] - offsets[position]
+            by_size.setdefault(size, []).append(position)
+        sizes = {size: to_bitset(positions, count)
+                 for size, positions in by_size.items()}
+        return version, (recipe_ids, offsets, ingredients), postings, sizes
+
+    def _rebuild(self, version):
+        try:
+            self._index = self._build(version)
+        except Exception:
+            logger.exception('Не удалось перестроить индекс состава рецептов')
+        finally:
+            self._rebuilding = False
+
+    def _rebuild_in_thread(self, version):
+        try:
+            self._rebuild(version)
+        finally:
+            connection.close()
+
+    def _start_rebuild(self, version):
+        """Запускает перестройку в фоне, если она еще не идет."""
+
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_thread,
+                         args=(version,), name='pantry-index',
+                         daemon=True).start()
+
+    def _load(self):
+        version = get_recipe_ingredients_version()
+        index = self._index
+        if index is None or (
+            index[0] != version
+            and not settings.PANTRY_INDEX_BACKGROUND_REBUILD
+        ):
+            with self._lock:
+                if self._index is None or self._index[0] != version:
+                    self._index = self._build(version)
+                index = self._index
+        elif index[0] != version:
+            self._start_rebuild(version)
+        return index[1:]
+
+    def match(self, ingredient_ids, max_missing=None):
+        """
+        Подбирает рецепты, в которых есть хотя бы один из переданных
+        ингредиентов. Элементы результата - кортежи (id рецепта, доля
+        имеющихся ингредиентов, число недостающих, список недостающих).
+        """
+
+        index, postings, sizes = self._load()
+        count = len(index[0])
+        available = {pk for pk in ingredient_ids if pk in postings}
+
+        planes, candidates = [], 0
+        for pk in available:
+            bitset = postings[pk]
+            if not isinstance(bitset, int):
+                bitset = to_bitset(bitset, count)
+            candidates |= bitset
+            add_to_counter(planes, bitset)
+
+        by_have = split_by_counter(planes, candidates)
+        groups = {}
+        for size, size_bitset in sizes.items():
+            for have, have_bitset in by_have.items():
+                missing = size - have
+                if missing < 0 or (max_missing is not None
+                                   and missing > max_missing):
+                    continue
+                bitset = have_bitset & size_bitset
+                if bitset:
+                    key = (have / size, missing)
+                    groups[key] = groups.get(key, 0) | bitset
+        return PantryMatches(
+            index,
+            [(*key, groups[key])
+             for key in sorted(groups, key=lambda key: (-key[0], key[1]))],
+            available
+        )
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,57 @@
+import math
+import time
+
+from django.conf import settings
+from django.db.models import F, FloatField, Func, Value
+from django.db.models.functions import Ln
+
+from recipes.counters import count_related
+from recipes.models import Recipe
+
+FAVORITE_WEIGHT = 2
+SHOPPING_CART_WEIGHT = 1
+
+
+class EpochSeconds(Func):
+    """Число секунд с начала эпохи для поля даты и времени."""
+
+    template = 'EXTRACT(EPOCH FROM %(expressions)s)'
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="CAST(strftime('%%%%s', %(expressions)s) AS REAL)",
+            **extra_context
+        )
+
+
+def popularity_expression(now=None):
+    """
+    Взвешенная сумма добавлений в избранное и в список покупок,
+    которая уменьшается вдвое каждые RECIPE_POPULARITY_HALF_LIFE часов
+    с момента публикации рецепта. Хранится логарифм ln(1 + сумма)
+    за вычетом ln 2 за каждый период полураспада: так у старых рецептов
+    значение не уходит в исчезающе малые числа, на которых PostgreSQL
+    падает с underflow, а рецепты без добавлений упорядочены по новизне.
+    """
+
+    now = time.time() if now is None else now
+    age_hours = (
+        Value(now, output_field=FloatField()) - EpochSeconds('pub_date')
+    ) / 3600
+    interactions = (
+        F('favorites_count') * FAVORITE_WEIGHT
+        + count_related(Recipe.shoppingcart.through.objects.all(), 'recipe')
+        * SHOPPING_CART_WEIGHT
+    )
+    return (
+        Ln(interactions + 1.0, output_field=FloatField())
+        - age_hours * (math.log(2) / settings.RECIPE_POPULARITY_HALF_LIFE)
+    )
+
+
+def update_popularity(now=None):
+    """Пересчитывает популярность всех рецептов одним запросом UPDATE."""
+
+    return Recipe.objects.update(popularity=popularity_expression(now))
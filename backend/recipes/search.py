@@ -0,0 +1,118 @@
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connections, transaction
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    FloatField,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+
+from recipes.models import IngredientInRecipe, Recipe
+
+SEARCH_CONFIG = 'russian'
+
+
+def is_postgresql(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def recipe_search_vector():
+    """
+    Вектор для полнотекстового поиска: название рецепта важнее
+    описания, а описание важнее названий ингредиентов.
+    """
+
+    ingredient_names = Subquery(
+        IngredientInRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+        + SearchVector(ingredient_names, weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_recipes_search_vectors(recipes):
+    """Пересчитывает поисковые векторы рецептов queryset одним UPDATE."""
+
+    if not is_postgresql(recipes):
+        return 0
+    return recipes.update(search_vector=recipe_search_vector())
+
+
+def update_search_vectors(*pks):
+    """Пересчитывает поисковые векторы рецептов одним запросом UPDATE."""
+
+    if not pks:
+        return 0
+    return update_recipes_search_vectors(Recipe.objects.filter(pk__in=pks))
+
+
+def schedule_search_update(*pks):
+    """
+    Обновляет векторы после фиксации транзакции, когда ингредиенты
+    рецепта уже сохранены.
+    """
+
+    transaction.on_commit(lambda: update_search_vectors(*pks))
+
+
+def schedule_ingredient_search_update(ingredient_id):
+    """
+    После фиксации транзакции обновляет векторы рецептов с ингредиентом.
+    Рецепты отбираются подзапросом внутри UPDATE, без выгрузки их id.
+    """
+
+    recipes = Recipe.objects.filter(
+        Exists(
+            IngredientInRecipe.objects.filter(
+                recipe=OuterRef('pk'), ingredient_id=ingredient_id
+            )
+        )
+    )
+    transaction.on_commit(lambda: update_recipes_search_vectors(recipes))
+
+
+def search_recipes(queryset, value):
+    """
+    Отбирает рецепты по поисковому запросу и добавляет к ним
+    релевантность rank. Без PostgreSQL ищет вхождение подстроки
+    в название, описание и названия ингредиентов.
+    """
+
+    if is_postgresql(queryset):
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        )
+
+    in_ingredients = Exists(
+        IngredientInRecipe.objects.filter(
+            recipe=OuterRef('pk'), ingredient__name__icontains=value
+        )
+    )
+    return queryset.filter(
+        Q(name__icontains=value) | Q(text__icontains=value) | in_ingredients
+    ).annotate(
+        rank=Case(
+            When(name__icontains=value, then=Value(1.0)),
+            When(text__icontains=value, then=Value(0.4)),
+            default=Value(0.2),
+            output_field=FloatField()
+        )
+    )
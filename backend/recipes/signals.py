@@ -0,0 +1,187 @@
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from recipes.cache import (
+    invalidate_authors_feed,
+    invalidate_catalog,
+    invalidate_recipe_ingredients,
+    invalidate_recipes,
+    invalidate_user_relations,
+)
+from recipes.counters import change_counter, recount_recipes
+from recipes.images import schedule_thumbnails
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from recipes.search import (
+    schedule_ingredient_search_update,
+    schedule_search_update,
+)
+from users.models import Follow, User
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_catalog_cache(**kwargs):
+    invalidate_catalog()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(instance, **kwargs):
+    invalidate_recipes(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(instance, created, **kwargs):
+    if created:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'recipes_count', 1)
+        invalidate_authors_feed(instance.author_id)
+        invalidate_recipe_ingredients()
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(instance, **kwargs):
+    change_counter(User.objects.filter(pk=instance.author_id),
+                   'recipes_count', -1)
+    invalidate_authors_feed(instance.author_id)
+    invalidate_recipe_ingredients()
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(instance, update_fields, **kwargs):
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    schedule_search_update(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+def update_recipe_ingredients_search(instance, **kwargs):
+    schedule_search_update(instance.recipe_id)
+
+
+@receiver(pre_save, sender=Ingredient)
+def remember_ingredient_name(instance, update_fields, **kwargs):
+    instance._saved_name = None
+    if instance.pk is None or (update_fields
+                               and 'name' not in update_fields):
+        return
+    instance._saved_name = Ingredient.objects.filter(
+        pk=instance.pk
+    ).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search(instance, created, **kwargs):
+    if created or instance._saved_name in (None, instance.name):
+        return
+    schedule_ingredient_search_update(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def create_thumbnails(instance, **kwargs):
+    if instance.image and instance.thumbnails.get('source') != (
+        instance.image.name
+    ):
+        transaction.on_commit(lambda: schedule_thumbnails(instance.pk))
+
+
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+def invalidate_recipe_ingredient(instance, **kwargs):
+    invalidate_recipes(instance.recipe_id)
+    invalidate_recipe_ingredients()
+
+
+@receiver(m2m_changed, sender=IngredientInRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_relations(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    if not action.startswith('post_'):
+        return
+    if sender is IngredientInRecipe:
+        invalidate_recipe_ingredients()
+    if reverse:
+        invalidate_recipes(*(pk_set or ()))
+    else:
+        invalidate_recipes(instance.pk)
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+@receiver(m2m_changed, sender=Recipe.shoppingcart.through)
+def invalidate_user_recipe_relations(sender, instance, action, reverse,
+                                     pk_set, **kwargs):
+    if reverse:
+        if action.startswith('post_'):
+            invalidate_user_relations(instance.pk)
+    elif action == 'pre_clear':
+        invalidate_user_relations(
+            *sender.objects.filter(recipe=instance).values_list(
+                'user_id', flat=True
+            )
+        )
+    elif action in ('post_add', 'post_remove'):
+        invalidate_user_relations(*pk_set)
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+def update_favorites_count(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """
+    Пересчитывает favorites_count рецептов после изменения избранного
+    через ORM, например в админке. Запросы API меняют связь сырым SQL
+    и счетчик сами, сигналы для них не отправляются.
+    """
+
+    if reverse and action == 'pre_clear':
+        remember_favorite_recipes(instance)
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        pks = [instance.pk]
+    elif action == 'post_clear':
+        pks = instance._favorite_recipes
+    else:
+        pks = pk_set
+    recount_recipes(Recipe.objects.filter(pk__in=pks))
+
+
+@receiver(pre_delete, sender=User)
+def remember_favorite_recipes(instance, **kwargs):
+    instance._favorite_recipes = list(
+        instance.favorited.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=User)
+def recount_user_favorites(instance, **kwargs):
+    recount_recipes(Recipe.objects.filter(pk__in=instance._favorite_recipes))
+
+
+@receiver(post_save, sender=Follow)
+def increase_followers_count(instance, created, **kwargs):
+    if created:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrease_followers_count(instance, **kwargs):
+    change_counter(User.objects.filter(pk=instance.author_id),
+                   'followers_count', -1)
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def invalidate_follower_relations(instance, **kwargs):
+    invalidate_user_relations(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(instance, update_fields, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    invalidate_recipes(*instance.recipes.values_list('id', flat=True))
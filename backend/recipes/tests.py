@@ -0,0 +1,237 @@
+import csv
+import io
+import json
+import tempfile
+from pathlib import Path
+from unittest import mock, skipIf, skipUnless
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+
+from recipes.cache import get_catalog_version
+from recipes.management.commands import load_csv
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import Follow, User
+
+
+class CatalogVersionTest(TestCase):
+    """Версия справочников меняется только после фиксации транзакции."""
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_bumped_on_commit(self, change):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+            self.assertEqual(get_catalog_version(), version)
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_tag_changes(self):
+        tag = Tag(name='Завтрак', color='#E26C2D', slug='breakfast')
+        self.assert_bumped_on_commit(tag.save)
+        self.assert_bumped_on_commit(tag.delete)
+
+    def test_ingredient_changes(self):
+        ingredient = Ingredient(name='Мука', measurement_unit='г')
+        self.assert_bumped_on_commit(ingredient.save)
+        ingredient.measurement_unit = 'кг'
+        self.assert_bumped_on_commit(ingredient.save)
+        self.assert_bumped_on_commit(ingredient.delete)
+
+
+class CountersSignalsTest(TestCase):
+    """
+    Счетчики favorites_count и followers_count не расходятся с данными
+    при изменениях через ORM, например в админке или в shell.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.first, cls.second = (
+            User.objects.create_user(
+                username=username, email=f'{username}@example.com',
+                first_name='Имя', last_name='Фамилия', password='pass-12345'
+            )
+            for username in ('author', 'first', 'second')
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                author=cls.author, image='recipes/test.png'
+            )
+            for number in range(2)
+        ]
+
+    def assert_favorites(self, *counts):
+        self.assertEqual(
+            [Recipe.objects.get(pk=recipe.pk).favorites_count
+             for recipe in self.recipes],
+            list(counts)
+        )
+
+    def assert_followers(self, count):
+        self.author.refresh_from_db(fields=('followers_count',))
+        self.assertEqual(self.author.followers_count, count)
+
+    def test_favorites_from_recipe_side(self):
+        recipe = self.recipes[0]
+        recipe.favorite.add(self.first, self.second)
+        recipe.favorite.add(self.first)
+        self.assert_favorites(2, 0)
+        recipe.favorite.remove(self.first)
+        recipe.favorite.remove(self.first)
+        self.assert_favorites(1, 0)
+        recipe.favorite.set([self.first])
+        self.assert_favorites(1, 0)
+        recipe.favorite.clear()
+        self.assert_favorites(0, 0)
+
+    def test_favorites_from_user_side(self):
+        self.first.favorited.add(*self.recipes)
+        self.second.favorited.add(self.recipes[1])
+        self.assert_favorites(1, 2)
+        self.second.favorited.remove(*self.recipes)
+        self.assert_favorites(1, 1)
+        self.first.favorited.clear()
+        self.assert_favorites(0, 0)
+
+    def test_deleted_user_favorites(self):
+        self.first.favorited.add(*self.recipes)
+        self.second.favorited.add(self.recipes[0])
+        self.first.delete()
+        self.assert_favorites(1, 0)
+
+    def test_followers(self):
+        follow = Follow.objects.create(user=self.first, author=self.author)
+        Follow.objects.create(user=self.second, author=self.author)
+        self.assert_followers(2)
+        follow.delete()
+        self.assert_followers(1)
+        Follow.objects.filter(author=self.author).delete()
+        self.assert_followers(0)
+
+    def test_deleted_follower(self):
+        Follow.objects.create(user=self.first, author=self.author)
+        Follow.objects.create(user=self.second, author=self.author)
+        self.second.delete()
+        self.assert_followers(1)
+
+
+INGREDIENTS = [('мука', 'г'), ('молоко', 'мл'), ('яйца', 'шт'),
+               ('соль, крупная', 'г'), ('соус "[острый]"', 'мл')]
+
+
+class LoadCsvCommandTest(TestCase):
+    """
+    load_csv загружает справочники пачками, повторный запуск не создает
+    дубликатов, а версия справочников меняется после фиксации.
+    """
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.data_dir = Path(directory.name)
+        patcher = mock.patch.object(load_csv, 'DATA_DIR', self.data_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with open(self.data_dir / 'ingredients.csv', 'w',
+                  encoding='utf-8', newline='') as data_file:
+            writer = csv.writer(data_file)
+            writer.writerow(('name', 'measurement_unit'))
+            writer.writerows(INGREDIENTS + INGREDIENTS[:1])
+        (self.data_dir / 'ingredients.json').write_text(
+            json.dumps(
+                [{'name': name, 'measurement_unit': unit}
+                 for name, unit in INGREDIENTS + [('масло', 'г')]],
+                ensure_ascii=False, indent=2
+            ),
+            encoding='utf-8'
+        )
+        (self.data_dir / 'tags.csv').write_text(
+            'name,color,slug\n'
+            'Завтрак,#E26C2D,breakfast\n'
+            'Обед,#49B64E,lunch\n',
+            encoding='utf-8'
+        )
+
+    def load(self, *args):
+        out = io.StringIO()
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_csv', *args, stdout=out)
+            self.assertEqual(get_catalog_version(), version)
+        self.assertNotEqual(get_catalog_version(), version)
+        return out.getvalue()
+
+    def ingredients(self):
+        return set(Ingredient.objects.values_list('name', 'measurement_unit'))
+
+    def test_csv_in_batches(self):
+        output = self.load('ingredients.csv', '--batch-size', '2')
+        self.assertIn('прочитано 6, добавлено 5', output)
+        self.assertEqual(self.ingredients(), set(INGREDIENTS))
+
+        output = self.load('ingredients.csv', '--batch-size', '4')
+        self.assertIn('прочитано 6, добавлено 0', output)
+        self.assertEqual(Ingredient.objects.count(), len(INGREDIENTS))
+
+    @mock.patch.object(load_csv, 'JSON_CHUNK_SIZE', 7)
+    def test_json_streaming(self):
+        self.load('ingredients.csv')
+        output = self.load('ingredients.json', '--batch-size', '3')
+        self.assertIn('прочитано 6, добавлено 1', output)
+        self.assertEqual(self.ingredients(),
+                         set(INGREDIENTS) | {('масло', 'г')})
+
+    def test_read_json(self):
+        rows = [{'name': name, 'measurement_unit': unit}
+                for name, unit in INGREDIENTS]
+        for chunk_size in (1, 5, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size), mock.patch.object(
+                load_csv, 'JSON_CHUNK_SIZE', chunk_size
+            ):
+                data_file = io.StringIO(
+                    ' \n' + json.dumps(rows, ensure_ascii=False, indent=1)
+                )
+                self.assertEqual(list(load_csv.read_json(data_file)), rows)
+                self.assertEqual(list(load_csv.read_json(io.StringIO('[]'))),
+                                 [])
+
+    def test_invalid_json(self):
+        for text in ('{"name": "мука"}', '[{"name": "мука"', '[1, }]'):
+            with self.subTest(text=text):
+                with self.assertRaises(CommandError):
+                    list(load_csv.read_json(io.StringIO(text)))
+
+    def test_tags(self):
+        self.assertIn('прочитано 2, добавлено 2',
+                      self.load('tags.csv', '--model', 'tag'))
+        self.assertIn('прочитано 2, добавлено 0',
+                      self.load('tags.csv', '--model', 'tag'))
+        self.assertEqual(list(Tag.objects.values_list('slug', flat=True)),
+                         ['breakfast', 'lunch'])
+
+    def test_unknown_format(self):
+        (self.data_dir / 'ingredients.txt').write_text('', encoding='utf-8')
+        with self.assertRaises(CommandError):
+            call_command('load_csv', 'ingredients.txt', stdout=io.StringIO())
+
+    @skipIf(connection.vendor == 'postgresql',
+            'COPY доступен на PostgreSQL')
+    def test_copy_requires_postgresql(self):
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            call_command('load_csv', '--copy', stdout=io.StringIO())
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'COPY проверяется только на PostgreSQL')
+    def test_copy(self):
+        output = self.load('ingredients.csv', '--copy', '--batch-size', '2')
+        self.assertIn('прочитано 6, добавлено 5', output)
+        self.assertEqual(self.ingredients(), set(INGREDIENTS))
+        output = self.load('ingredients.json', '--copy', '--batch-size', '4')
+        self.assertIn('прочитано 6, добавлено 1', output)
@@ -0,0 +1,49 @@
+from django.db.models import Case, F, Value, When
+
+from recipes.ingredient_index import normalize
+
+UNIT_CONVERSIONS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+}
+"""
+Единица измерения -> (основная единица, множитель). Ложками и стаканами
+в справочнике меряют и жидкости, и пасты, сыры, сухофрукты, а плотности
+продуктов неизвестны, поэтому такие меры остаются как есть.
+"""
+
+
+def canonical_unit(field):
+    """Выражение с основной единицей измерения для поля field."""
+
+    return Case(
+        *(When(**{field: unit}, then=Value(canonical))
+          for unit, (canonical, _) in UNIT_CONVERSIONS.items()),
+        default=F(field)
+    )
+
+
+def unit_factor(field):
+    """Выражение с множителем перевода в основную единицу."""
+
+    return Case(
+        *(When(**{field: unit}, then=Value(factor))
+          for unit, (_, factor) in UNIT_CONVERSIONS.items()),
+        default=Value(1)
+    )
+
+
+def merge_by_name(rows):
+    """
+    Объединяет строки с одинаковыми названием без учета регистра
+    и буквы ё и единицей измерения, складывая количество.
+    """
+
+    merged = {}
+    for row in rows:
+        key = (normalize(row['name']), row['measurement_unit'])
+        if key in merged:
+            merged[key]['amount'] += row['amount']
+        else:
+            merged[key] = dict(row)
+    return [merged[key] for key in sorted(merged)]
@@ -0,0 +1,11 @@
+from itertools import islice
+
+
+def batches(rows, batch_size):
+    """Разбивает итератор на списки не длиннее batch_size."""
+
+    rows = iter(rows)
+    batch = list(islice(rows, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, batch_size))
@@ -9,7 +9,8 @@ User = get_user_model()
 
 @admin.register(User)
 class UserAdmin(UserAdmin):
-    list_display = ('email', 'username', 'first_name', 'last_name')
+    list_display = ('email', 'username', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     list_display_links = ('username',)
     list_filter = ('email', 'username')
     add_fieldsets = UserAdmin.add_fieldsets + (
@@ -28,6 +28,12 @@ class User(AbstractUser):
                                  verbose_name='Фамилия')
     password = models.CharField(max_length=MAX_FIELDS_LENGTH,
                                 verbose_name='Пароль')
+    recipes_count = models.PositiveIntegerField(default=0,
+                                                editable=False,
+                                                verbose_name='Рецептов')
+    followers_count = models.PositiveIntegerField(default=0,
+                                                  editable=False,
+                                                  verbose_name='Подписчиков')
 
     REQUIRED_FIELDS = ['email', 'first_name', 'last_name']
 